@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vi:ts=4 sw=4 et
+
+"""Compara o desempenho das filas de eventos disponíveis em
+simulador.ESCALONADORES nos cenários 1 a 4.
+
+Como os empates são desfeitos pelo número de sequência, todas as filas
+processam exatamente a mesma sequência de eventos. A utilização medida
+é exibida junto com o tempo para confirmar isso.
+
+Nestes cenários a fila tem poucas dezenas de eventos pendentes (no
+máximo um ou dois por host), e o heap binário, implementado em C pelo
+módulo heapq, continua o mais rápido: com tão poucos eventos, o O(log n)
+do heap custa menos que o trabalho em Python por evento do calendário
+e da escada. Essas filas só compensam com muito mais eventos pendentes."""
+
+import cStringIO
+import sys
+import time
+
+import rodar_cenario
+from simulador import ESCALONADORES
+
+
+def medir(fabrica, escalonador, eventos):
+    """Executa 'eventos' eventos de transiente e mais 'eventos' eventos
+    em uma rodada. Retorna (segundos, utilização medida)."""
+
+    simulador = fabrica()
+    simulador.escalonador = escalonador
+    simulador.eventos_fase_transiente = eventos
+    simulador.eventos_por_rodada = eventos
+    simulador.numero_de_rodadas = 1
+
+    # Mesma semente para todas as filas
+    simulador.semente = 1
+
+    # Descartando o relatório impresso pelo simulador
+    stdout = sys.stdout
+    sys.stdout = cStringIO.StringIO()
+    try:
+        comeco = time.time()
+        simulador.start()
+        simulador.run()
+        duracao = time.time() - comeco
+    finally:
+        sys.stdout = stdout
+
+    return duracao, simulador.utilizacao_global.media()
+
+
+def main():
+    if len(sys.argv) > 2:
+        print "Digite: %s [eventos por rodada]" % (sys.argv[0],)
+        sys.exit(1)
+
+    eventos = 200000
+    if len(sys.argv) == 2:
+        eventos = int(sys.argv[1])
+
+    escalonadores = sorted(ESCALONADORES.keys())
+
+    print "%-10s %-12s %10s %14s %12s" % ("Cenário", "Escalonador", "Segundos", "Eventos/s", "Utilização")
+    for id in sorted(rodar_cenario.cenarios.keys()):
+        for escalonador in escalonadores:
+            duracao, utilizacao = medir(rodar_cenario.cenarios[id], escalonador, eventos)
+            print "%-10s %-12s %10.2f %14.0f %12.6f" % (id, escalonador, duracao, 2 * eventos / duracao, utilizacao)
+
+if __name__ == "__main__":
+    main()
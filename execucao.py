@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+# vi:ts=4 sw=4 et
+
+"""Execução dos cenários fora do simulador propriamente dito: o pool de
+processos usado pelas replicações, pela varredura de parâmetros e por
+rodar_todos_os_cenarios.py, o cache de resultados e a linha de comando
+dos scripts rodar_cenario*.py."""
+
+import collections
+import contextlib
+import cPickle as pickle
+import itertools
+import multiprocessing
+import optparse
+import os
+import sys
+import time
+
+from simulador import carregar_checkpoint, gravar_pickle
+
+
+######################################################################
+# Linha de comando
+
+class OptionParser(optparse.OptionParser):
+    """optparse.OptionParser que aceita acentos nas mensagens de ajuda.
+    O do Python 2 passa a ajuda por encode(), o que falha com strings
+    (str) que não são ASCII, e --help terminava com UnicodeDecodeError."""
+
+    def print_help(self, file=None):
+        if file is None:
+            file = sys.stdout
+        file.write(self.format_help())
+
+
+######################################################################
+# Execução em paralelo
+
+def executar_em_paralelo(funcao, tarefas, processos=None, max_pendentes=None,
+                         inicializador=None, argumentos_inicializador=()):
+    """Executa funcao(tarefa) para cada tarefa de 'tarefas' em um pool de
+    'processos' processos (por padrão, o número de CPUs), gerando os
+    resultados na ordem das tarefas.
+
+    Com 'max_pendentes', no máximo esse número de tarefas fica em
+    andamento de cada vez, e 'tarefas' pode ser um iterador infinito; sem
+    ele, todas as tarefas são enviadas ao pool logo no começo. O pool é
+    encerrado quando os resultados acabam ou quando o gerador é fechado
+    (ver rodar_replicacoes)."""
+
+    if processos is None:
+        processos = multiprocessing.cpu_count()
+
+    tarefas = iter(tarefas)
+    primeiras = list(itertools.islice(tarefas, max_pendentes))
+    if not primeiras:
+        return
+
+    pool = multiprocessing.Pool(processos, inicializador, argumentos_inicializador)
+    try:
+        pendentes = collections.deque(pool.apply_async(funcao, (tarefa,)) for tarefa in primeiras)
+        while pendentes:
+            # O timeout permite interromper com Ctrl+C (bug do Python 2)
+            resultado = pendentes.popleft().get(10**9)
+            for tarefa in itertools.islice(tarefas, 1):
+                pendentes.append(pool.apply_async(funcao, (tarefa,)))
+            yield resultado
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+######################################################################
+# Cache de resultados
+
+class CacheDeResultados(object):
+    """Guarda os resultados de simulações já executadas em um diretório,
+    um arquivo .pickle por chave (ver Simulador.chave_de_cache).
+
+    Quando o tamanho total passa de 'tamanho_maximo' bytes, os arquivos
+    usados há mais tempo são removidos (a data de modificação de cada
+    arquivo é atualizada sempre que ele é lido)."""
+
+    def __init__(self, diretorio="cache_resultados", tamanho_maximo=500 * 1024 * 1024):
+        self.diretorio = diretorio
+        self.tamanho_maximo = tamanho_maximo
+
+    def arquivo(self, chave):
+        return os.path.join(self.diretorio, chave + ".pickle")
+
+    def carregar(self, chave):
+        """Retorna o resultado guardado com a chave, ou None."""
+
+        arquivo = self.arquivo(chave)
+        try:
+            with open(arquivo, "rb") as f:
+                resultado = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return None
+        os.utime(arquivo, None)
+        return resultado
+
+    def guardar(self, chave, resultado):
+        if not os.path.isdir(self.diretorio):
+            os.makedirs(self.diretorio)
+        gravar_pickle(resultado, self.arquivo(chave))
+        self.limitar()
+
+    def invalidar(self, chave=None):
+        """Remove o resultado guardado com a chave, ou todos os resultados
+        se a chave for None. Retorna o número de arquivos removidos."""
+
+        if chave is None:
+            arquivos = self.arquivos()
+        else:
+            arquivos = [self.arquivo(chave)]
+        removidos = 0
+        for arquivo in arquivos:
+            if os.path.exists(arquivo):
+                os.remove(arquivo)
+                removidos += 1
+        return removidos
+
+    def arquivos(self):
+        if not os.path.isdir(self.diretorio):
+            return []
+        return [
+            os.path.join(self.diretorio, nome)
+            for nome in os.listdir(self.diretorio)
+            if nome.endswith(".pickle")
+        ]
+
+    def limitar(self):
+        """Remove os resultados usados há mais tempo até o cache ficar com
+        no máximo 'tamanho_maximo' bytes."""
+
+        arquivos = sorted((os.stat(arquivo).st_mtime, os.stat(arquivo).st_size, arquivo)
+                          for arquivo in self.arquivos())
+        total = sum(tamanho for data, tamanho, arquivo in arquivos)
+        for data, tamanho, arquivo in arquivos:
+            if total <= self.tamanho_maximo:
+                break
+            try:
+                os.remove(arquivo)
+            except OSError:
+                # Já removido por outro processo
+                pass
+            total -= tamanho
+
+
+######################################################################
+# Replicações independentes em paralelo
+
+# Simulador após a fase transiente (salvo pelo pickle), compartilhado
+# pelas replicações de cada processo do pool
+_simulador_aquecido = None
+
+
+def _iniciar_processo(simulador_aquecido):
+    """Inicializa um processo do pool. Em sistemas com fork(), o
+    argumento não é copiado pelo pickle: o processo filho já começa com
+    ele na memória."""
+
+    global _simulador_aquecido
+    _simulador_aquecido = simulador_aquecido
+
+
+def _executar_replicacao(argumentos):
+    """Executa, em um processo do pool, uma replicação independente do
+    cenário criado por 'fabrica'. Retorna as médias das rodadas."""
+
+    fabrica, semente, rodadas = argumentos
+
+    if _simulador_aquecido is not None:
+        simulador = pickle.loads(_simulador_aquecido)
+        simulador.semente = semente
+        simulador.semear(semente)
+        simulador.arquivo_trace = None
+    else:
+        simulador = fabrica()
+        simulador.semente = semente
+        simulador.verboso = False
+        simulador.start()
+    simulador.numero_de_rodadas = rodadas
+    simulador.run()
+
+    return simulador.amostras_das_rodadas()
+
+
+def rodar_replicacoes(fabrica, processos=None, rodadas_por_replicacao=10, semente=1,
+                      transiente_compartilhado=False):
+    """Executa replicações independentes do cenário em paralelo, uma por
+    processo, até as estatísticas combinadas chegarem à precisão
+    desejada.
+
+    'fabrica' é uma função sem parâmetros que cria o Simulador (como as
+    funções cenarioN dos scripts rodar_cenario*.py). Cada replicação
+    executa a fase transiente e mais 'rodadas_por_replicacao' rodadas,
+    com a semente semente+i. As médias das rodadas de todas as
+    replicações são combinadas, na ordem das sementes, nas estatísticas
+    globais de um Simulador criado pela mesma fábrica, que é retornado.
+
+    Se o cenário tiver número de rodadas fixo, são feitas apenas as
+    replicações necessárias para completar esse número de rodadas.
+
+    Com 'transiente_compartilhado', a fase transiente é executada uma só
+    vez, com a semente 'semente', e todas as replicações continuam a
+    partir do estado ao final dela (ver Simulador.bifurcar), com as
+    sementes semente+1, semente+2, ... As replicações deixam de ser
+    totalmente independentes, pois partem do mesmo estado, mas nenhuma
+    delas repete a fase transiente."""
+
+    simulador = fabrica()
+    simulador.start()
+
+    if processos is None:
+        processos = multiprocessing.cpu_count()
+
+    wallclock_comeco_simulacao = time.time()
+
+    simulador_aquecido = None
+    proxima_semente = semente
+    if transiente_compartilhado:
+        aquecido = fabrica()
+        aquecido.semente = semente
+        aquecido.verboso = False
+        aquecido.start()
+        aquecido.run(ate_rodada=0)
+        simulador_aquecido = pickle.dumps(aquecido, protocol=2)
+        del aquecido
+        proxima_semente += 1
+
+        if simulador.verboso:
+            print "Fase transiente: %.2f segundos" % (time.time() - wallclock_comeco_simulacao,)
+
+    replicacoes = (
+        (fabrica, semente_replicacao, rodadas_por_replicacao)
+        for semente_replicacao in itertools.count(proxima_semente)
+    )
+
+    # Os processos são criados depois da fase transiente, para que
+    # recebam o simulador aquecido já na memória. Ficam sempre
+    # 'processos' replicações em andamento.
+    resultados = executar_em_paralelo(
+        _executar_replicacao, replicacoes, processos, max_pendentes=processos,
+        inicializador=_iniciar_processo, argumentos_inicializador=(simulador_aquecido,))
+    with contextlib.closing(resultados):
+        for replicacoes_concluidas, amostras in enumerate(resultados, 1):
+            simulador.incorporar_rodadas(amostras)
+
+            if simulador.verboso:
+                print "Replicação %d" % (replicacoes_concluidas,)
+                print "-Tempo real: %.2f segundos no total" % (time.time() - wallclock_comeco_simulacao,)
+                print "-Rodadas combinadas: %d" % (simulador.rodada_atual,)
+                simulador.imprimir_relatorio()
+
+            if simulador.numero_de_rodadas < 0:
+                if simulador.precisao_suficiente():
+                    break
+            elif simulador.rodada_atual >= simulador.numero_de_rodadas:
+                break
+
+    return simulador
+
+
+######################################################################
+# Linha de comando dos scripts rodar_cenario*.py
+
+def linha_de_comando(cenarios, prefixo_arquivo):
+    """Executa o cenário escolhido na linha de comando e salva os
+    resultados. 'cenarios' é um dicionário que associa o nome de cada
+    cenário à função que cria o Simulador, e 'prefixo_arquivo' é o
+    formato do nome dos arquivos gerados (por exemplo, "cenario_%s")."""
+
+    parser = OptionParser(usage="%prog [opções] <cenário>")
+    parser.add_option("-r", "--replicacoes", action="store_true", default=False,
+        help="executa replicações independentes em paralelo")
+    parser.add_option("-p", "--processos", type="int", default=None,
+        help="número de processos usados nas replicações (padrão: número de CPUs)")
+    parser.add_option("-t", "--transiente-compartilhado", action="store_true", default=False,
+        help="com -r, executa a fase transiente uma só vez e começa todas as "
+             "replicações a partir do estado ao final dela")
+    parser.add_option("-s", "--semente", type="int", default=None,
+        help="semente dos geradores aleatórios, para repetir uma execução "
+             "(com -r, semente da primeira replicação; padrão: 1)")
+    parser.add_option("-c", "--checkpoint", metavar="ARQUIVO", default=None,
+        help="salva o estado da simulação periodicamente em ARQUIVO; se ele "
+             "já existir, continua a simulação a partir dele")
+    parser.add_option("-n", "--rodadas-por-checkpoint", type="int", default=10,
+        help="intervalo, em rodadas, entre os checkpoints (padrão: 10)")
+    parser.add_option("--perfil", metavar="ARQUIVO", default=None,
+        help="acrescenta a ARQUIVO o perfil de desempenho de cada rodada "
+             "(um objeto JSON por linha)")
+    parser.add_option("--trace", metavar="ARQUIVO", default=None,
+        help="grava em ARQUIVO o trace binário dos eventos (ver ler_trace.py)")
+    parser.add_option("--cache", metavar="DIRETORIO", default="cache_resultados",
+        help="diretório do cache de resultados (padrão: cache_resultados)")
+    parser.add_option("--tamanho-cache", type="int", default=500, metavar="MB",
+        help="tamanho máximo do cache; os resultados usados há mais tempo "
+             "são removidos (padrão: 500 MB)")
+    parser.add_option("--sem-cache", action="store_true", default=False,
+        help="não usa o cache de resultados")
+    parser.add_option("--invalidar", action="store_true", default=False,
+        help="remove do cache o resultado do cenário, simulando-o de novo")
+    parser.add_option("--limpar-cache", action="store_true", default=False,
+        help="remove todos os resultados do cache e termina")
+    opcoes, argumentos = parser.parse_args()
+
+    cache = CacheDeResultados(opcoes.cache, opcoes.tamanho_cache * 1024 * 1024)
+    if opcoes.limpar_cache:
+        print "%d resultados removidos do cache" % (cache.invalidar(),)
+        sys.exit(0)
+
+    if len(argumentos) != 1 or argumentos[0] not in cenarios:
+        print "Digite: %s [opções] <cenário>" % (sys.argv[0],)
+        print "Cenários disponíveis: " + " ".join(sorted(cenarios.keys()))
+        sys.exit(1)
+
+    id = argumentos[0]
+    file_prefix = prefixo_arquivo % (id,)
+
+    if opcoes.replicacoes and opcoes.semente is None:
+        opcoes.semente = 1
+
+    # O resultado é procurado no cache pela definição do cenário
+    simulador = cenarios[id]()
+    if opcoes.semente is not None:
+        simulador.semente = opcoes.semente
+    if opcoes.replicacoes:
+        chave = simulador.chave_de_cache("replicacoes", opcoes.transiente_compartilhado)
+    else:
+        chave = simulador.chave_de_cache()
+
+    if opcoes.invalidar:
+        cache.invalidar(chave)
+    if opcoes.sem_cache:
+        resultado = None
+    else:
+        resultado = cache.carregar(chave)
+
+    if resultado is not None:
+        simulador = resultado
+        print "Resultado carregado do cache (%s)" % (cache.arquivo(chave),)
+        simulador.imprimir_relatorio()
+    elif opcoes.replicacoes:
+        simulador = rodar_replicacoes(cenarios[id], processos=opcoes.processos,
+                                      semente=opcoes.semente,
+                                      transiente_compartilhado=opcoes.transiente_compartilhado)
+    elif opcoes.checkpoint and os.path.exists(opcoes.checkpoint):
+        simulador = carregar_checkpoint(opcoes.checkpoint)
+        simulador.rodadas_por_checkpoint = opcoes.rodadas_por_checkpoint
+        print "Continuando a partir de %s (rodada %d)" % (opcoes.checkpoint, simulador.rodada_atual)
+        simulador.run()
+    else:
+        simulador.arquivo_checkpoint = opcoes.checkpoint
+        simulador.rodadas_por_checkpoint = opcoes.rodadas_por_checkpoint
+        simulador.arquivo_perfil = opcoes.perfil
+        simulador.arquivo_trace = opcoes.trace
+        simulador.start()
+        simulador.run()
+
+    if resultado is None and not opcoes.sem_cache:
+        cache.guardar(chave, simulador)
+
+    salvar_resultados(simulador, file_prefix)
+
+    # Exibindo os gráficos na tela
+    simulador.gerar_graficos()
+    simulador.exibir_graficos()
+
+
+def salvar_resultados(simulador, file_prefix):
+    """Salva o simulador (com todas as estatísticas coletadas) e os
+    gráficos em arquivos começando com 'file_prefix'."""
+
+    # Salvando os resultados num arquivo
+    with open(file_prefix + ".pickle", "wb") as f:
+        pickle.dump(simulador, f, protocol=2)
+    # Depois, é possível recarregar os resultados usando:
+    #   simulador = carregar_checkpoint("cenario_1.pickle")
+    # Depois de carregado, é possível acessar normalmente todos os
+    # membros do objeto simulador, e inclusive gerar novos gráficos.
+    # Para continuar uma simulação interrompida, use os checkpoints (a
+    # opção -c dos scripts rodar_cenario*.py).
+
+    # Salvando os gráficos num arquivo
+    simulador.gerar_graficos(layout="vertical")
+    simulador.salvar_graficos(file_prefix + ".png")
+    simulador.salvar_graficos(file_prefix + ".eps")
+    simulador.salvar_graficos(file_prefix + ".svg")
+    # Também é possível salvar em formatos .eps, .ps, .svg, .pdf
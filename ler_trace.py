@@ -0,0 +1,444 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vi:ts=4 sw=4 et
+
+"""Lê um trace binário gravado pelo simulador (opção --trace dos scripts
+rodar_cenario*.py) e imprime os eventos, um por linha, um resumo com o
+número de eventos de cada tipo em cada host, ou as estatísticas da
+simulação recalculadas a partir do trace.
+
+O arquivo é mapeado na memória e processado em pedaços com o NumPy,
+então mesmo traces de dezenas de gigabytes podem ser examinados sem
+carregá-los por inteiro e sem repetir a simulação."""
+
+import sys
+
+import numpy
+
+from execucao import OptionParser
+from simulador import (
+    TIPOS_DE_EVENTO, ler_trace, Estatisticas, HistogramaLog,
+    ChegouMensagem, InicioDeEnvio, FimDeEnvio, InicioDeRecebimento, FimDeRecebimento,
+    MARCA_DESCARTADA, MARCA_JAM, MARCA_SUCESSO, MARCA_COLISAO, MARCA_PERDIDO,
+    MARCA_FIM_DE_MENSAGEM,
+)
+
+
+# Número de registros processados de cada vez
+REGISTROS_POR_PEDACO = 1 << 20
+
+NOMES_DAS_MARCAS = [
+    (MARCA_DESCARTADA, "descartada"),
+    (MARCA_JAM, "jam"),
+    (MARCA_SUCESSO, "sucesso"),
+    (MARCA_COLISAO, "colisão"),
+    (MARCA_PERDIDO, "perdido"),
+    (MARCA_FIM_DE_MENSAGEM, "fim-de-mensagem"),
+]
+
+
+def nome_do_host(hosts, indice):
+    if indice < 0:
+        return "HUB"
+    return hosts[indice]
+
+
+def pedacos(registros, tamanho=REGISTROS_POR_PEDACO):
+    """Percorre os registros em pedaços de 'tamanho' registros, cada um
+    copiado para a memória."""
+
+    for inicio in xrange(0, len(registros), tamanho):
+        yield numpy.array(registros[inicio:inicio + tamanho])
+
+
+def codigos_dos_filtros(opcoes, hosts):
+    """Converte os nomes dos filtros --tipo e --host nos códigos usados
+    nos registros. Retorna (tipos, índices dos hosts), com None para os
+    filtros não usados."""
+
+    tipos = indices = None
+    if opcoes.tipo:
+        nomes = [classe.__name__ for classe in TIPOS_DE_EVENTO]
+        tipos = [nomes.index(nome) for nome in opcoes.tipo]
+    if opcoes.host:
+        indices = [-1 if nome == "HUB" else hosts.index(nome) for nome in opcoes.host]
+    return tipos, indices
+
+
+def buscar(registros, campo, valor, depois=False):
+    """Busca binária no 'campo' dos registros, que nunca diminui ao longo
+    do trace. Retorna a posição do primeiro registro com o campo maior ou
+    igual a 'valor' (ou estritamente maior, com 'depois').
+
+    Ao contrário de numpy.searchsorted(registros[campo], ...), que copiaria
+    a coluna inteira do arquivo para a memória, lê apenas os registros
+    visitados pela busca."""
+
+    inicio, fim = 0, len(registros)
+    while inicio < fim:
+        meio = (inicio + fim) // 2
+        atual = registros[meio][campo]
+        if atual < valor or (depois and atual == valor):
+            inicio = meio + 1
+        else:
+            fim = meio
+    return inicio
+
+
+def filtrar(registros, opcoes, codigos, limite=None):
+    """Percorre, pedaço por pedaço, os registros que passam pelos
+    filtros das 'opcoes' (com os 'codigos' de codigos_dos_filtros()),
+    parando depois de 'limite' registros.
+
+    Como o tempo e a rodada nunca diminuem ao longo do trace, os
+    filtros de tempo e de rodada são aplicados por busca binária, e só
+    o trecho selecionado é lido do arquivo."""
+
+    tipos, indices = codigos
+
+    inicio, fim = 0, len(registros)
+    if opcoes.rodada is not None:
+        inicio = max(inicio, buscar(registros, "rodada", opcoes.rodada))
+        fim = min(fim, buscar(registros, "rodada", opcoes.rodada, depois=True))
+    if opcoes.de is not None:
+        inicio = max(inicio, buscar(registros, "tempo", opcoes.de))
+    if opcoes.ate is not None:
+        fim = min(fim, buscar(registros, "tempo", opcoes.ate, depois=True))
+    registros = registros[inicio:max(inicio, fim)]
+
+    if tipos is None and indices is None and limite is not None:
+        registros = registros[:limite]
+
+    for pedaco in pedacos(registros):
+        if tipos is not None:
+            pedaco = pedaco[numpy.in1d(pedaco["tipo"], tipos)]
+        if indices is not None:
+            pedaco = pedaco[numpy.in1d(pedaco["host"], indices)]
+        if limite is not None:
+            pedaco = pedaco[:limite]
+            limite -= len(pedaco)
+        if len(pedaco):
+            yield pedaco
+        if limite == 0:
+            break
+
+
+def imprimir_eventos(pedacos_filtrados, hosts):
+    for pedaco in pedacos_filtrados:
+        for registro in pedaco:
+            detalhes = []
+            if registro["tipo"] == ChegouMensagem.TIPO:
+                detalhes.append("%d quadros" % (registro["quadros"],))
+            if registro["tipo"] in (InicioDeRecebimento.TIPO, FimDeRecebimento.TIPO):
+                detalhes.append("origem=%s" % (hosts[registro["origem"]],))
+            detalhes.extend(nome for marca, nome in NOMES_DAS_MARCAS if registro["marcas"] & marca)
+            print "%18.3f %6d %-6s %-20s %s" % (
+                registro["tempo"], registro["rodada"], nome_do_host(hosts, registro["host"]),
+                TIPOS_DE_EVENTO[registro["tipo"]].__name__, " ".join(detalhes))
+
+
+def imprimir_resumo(pedacos_filtrados, hosts):
+    num_tipos = len(TIPOS_DE_EVENTO)
+
+    # Contagem de cada par (host, tipo), somada pedaço por pedaço. Como
+    # os registros estão em ordem, os extremos de tempo e de rodada são
+    # os do primeiro e do último registro.
+    linhas = numpy.zeros((len(hosts) + 1) * num_tipos, dtype=numpy.int64)
+    total = 0
+    primeiro = ultimo = None
+    for pedaco in pedacos_filtrados:
+        if primeiro is None:
+            primeiro = pedaco[0]
+        ultimo = pedaco[-1]
+        total += len(pedaco)
+        linhas += numpy.bincount(
+            (pedaco["host"].astype(int) + 1) * num_tipos + pedaco["tipo"],
+            minlength=len(linhas))
+
+    print "%d eventos" % (total,)
+    if total == 0:
+        return
+    print "tempo: %.3f a %.3f; rodadas: %d a %d" % (
+        primeiro["tempo"], ultimo["tempo"], primeiro["rodada"], ultimo["rodada"])
+    print
+
+    colunas = [classe.__name__ for classe in TIPOS_DE_EVENTO]
+    largura = max(len(nome) for nome in colunas)
+    print "%-6s" % ("Host",) + "".join(" %*s" % (largura, nome) for nome in colunas)
+
+    linhas = linhas.reshape(len(hosts) + 1, num_tipos)
+    for indice, contagem in enumerate(linhas):
+        if contagem.any():
+            print "%-6s" % (nome_do_host(hosts, indice - 1),) + "".join(
+                " %*d" % (largura, n) for n in contagem)
+
+
+class Ocupacao(object):
+    """Acumula, rodada por rodada, o tempo em que um host vê o Ethernet
+    ocupado (transmitindo ou recebendo algum quadro), a partir das bordas
+    de portadora reconstruídas do trace.
+
+    As bordas de recebimento são deduzidas dos eventos do hub e da
+    distância do host, como no modo de difusão analítica. Por causa do
+    atraso de propagação, uma borda pode cair depois do último evento de
+    um pedaço; essas bordas ficam pendentes até o pedaço seguinte."""
+
+    def __init__(self, indice, atraso, num_rodadas):
+        self.indice = indice
+        # Atraso de propagação do hub até este host
+        self.atraso = atraso
+        self.ocupado = numpy.zeros(num_rodadas)
+
+        # Estado no tempo 'tempo_anterior': quadros sendo recebidos e
+        # flag de transmissão
+        self.no_meio = 0
+        self.enviando = 0
+        self.tempo_anterior = 0.0
+        # Bordas pendentes: (tempos, variação no_meio, variação enviando)
+        self.pendentes = (numpy.zeros(0), numpy.zeros(0, int), numpy.zeros(0, int))
+
+    def acumular(self, pedaco, fronteiras, fins):
+        """Processa as bordas do 'pedaco' até o tempo do seu último
+        registro. 'fronteiras' são os tempos dos últimos registros de
+        cada rodada do pedaço, e 'fins' os tempos de fim das rodadas já
+        terminadas."""
+
+        limite = fronteiras[-1]
+
+        tempo = pedaco["tempo"]
+        tipo = pedaco["tipo"]
+        host = pedaco["host"]
+
+        do_hub = (host == -1) & (pedaco["origem"] != self.indice)
+        inicio_recebimento = do_hub & (tipo == InicioDeRecebimento.TIPO)
+        fim_recebimento = do_hub & (tipo == FimDeRecebimento.TIPO)
+        inicio_envio = (host == self.indice) & (tipo == InicioDeEnvio.TIPO)
+        fim_envio = (host == self.indice) & (tipo == FimDeEnvio.TIPO)
+
+        recebimento = inicio_recebimento | fim_recebimento
+        envio = inicio_envio | fim_envio
+        tempos_pendentes, meio_pendente, envio_pendente = self.pendentes
+
+        # As fronteiras entram como bordas sem variação, para que nenhum
+        # intervalo atravesse o fim de uma rodada
+        sem_variacao = numpy.zeros(len(fronteiras), int)
+        tempos = numpy.concatenate((
+            tempos_pendentes,
+            tempo[recebimento] + self.atraso,
+            tempo[envio],
+            fronteiras,
+        ))
+        delta_meio = numpy.concatenate((
+            meio_pendente,
+            numpy.where(inicio_recebimento[recebimento], 1, -1),
+            numpy.zeros(envio.sum(), int),
+            sem_variacao,
+        ))
+        delta_envio = numpy.concatenate((
+            envio_pendente,
+            numpy.zeros(recebimento.sum(), int),
+            numpy.where(inicio_envio[envio], 1, -1),
+            sem_variacao,
+        ))
+
+        ordem = numpy.argsort(tempos, kind="mergesort")
+        tempos = tempos[ordem]
+        delta_meio = delta_meio[ordem]
+        delta_envio = delta_envio[ordem]
+
+        agora = tempos <= limite
+        self.pendentes = (tempos[~agora], delta_meio[~agora], delta_envio[~agora])
+        tempos = tempos[agora]
+        delta_meio = delta_meio[agora]
+        delta_envio = delta_envio[agora]
+
+        # Estado em cada intervalo entre bordas consecutivas
+        no_meio = self.no_meio + numpy.concatenate(([0], numpy.cumsum(delta_meio)))
+        enviando = self.enviando + numpy.concatenate(([0], numpy.cumsum(delta_envio)))
+        comecos = numpy.concatenate(([self.tempo_anterior], tempos))
+        ocupado = ((no_meio > 0) | (enviando > 0))[:-1]
+        duracoes = numpy.diff(comecos)
+
+        rodadas = numpy.searchsorted(fins, comecos[:-1], side="right")
+        self.ocupado += numpy.bincount(rodadas[ocupado], duracoes[ocupado], minlength=len(self.ocupado))
+
+        self.no_meio = no_meio[-1]
+        self.enviando = enviando[-1]
+        self.tempo_anterior = limite
+
+
+def calcular_metricas(metadados, registros, percentis=(50, 95, 99), tamanho_pedaco=REGISTROS_POR_PEDACO):
+    """Recalcula a partir do trace as estatísticas de cada rodada, como o
+    simulador as calcula: TAp, TAm, NCm, vazão e utilização do Ethernet
+    vista por cada host. Retorna um dicionário com os tempos de fim das
+    rodadas, as estatísticas globais (objetos Estatisticas com as médias
+    das rodadas 1 em diante) e os 'percentis' das amostras de TAp e TAm
+    dessas rodadas.
+
+    Os percentis são estimados por um HistogramaLog de cada host, como
+    no simulador, e a memória usada não depende do tamanho do trace."""
+
+    hosts = metadados["hosts"]
+    num_hosts = len(hosts)
+    num_rodadas = int(registros["rodada"][-1]) + 1 if len(registros) else 0
+
+    somas = dict((nome, numpy.zeros(num_hosts * num_rodadas)) for nome in ("tap", "tam", "ncm"))
+    contagens = dict((nome, numpy.zeros(num_hosts * num_rodadas)) for nome in ("tap", "tam", "ncm"))
+    histogramas_tap = [HistogramaLog() for host in hosts]
+    histogramas_tam = [HistogramaLog() for host in hosts]
+    fins = numpy.zeros(num_rodadas)
+    ocupacoes = [
+        Ocupacao(indice, distancia * metadados["tempo_propagacao"], num_rodadas)
+        for indice, distancia in enumerate(metadados["distancias"])
+    ]
+
+    for pedaco in pedacos(registros, tamanho_pedaco):
+        tempo = pedaco["tempo"]
+        rodada = pedaco["rodada"]
+        host = pedaco["host"].astype(int)
+        marcas = pedaco["marcas"]
+
+        # Fim de cada rodada: o tempo do seu último evento
+        ultimos = numpy.append(numpy.flatnonzero(numpy.diff(rodada)), len(pedaco) - 1)
+        fins[rodada[ultimos]] = tempo[ultimos]
+
+        # As estatísticas de uma mensagem só contam na rodada em que ela
+        # chegou (como no simulador)
+        valida = (host >= 0) & (pedaco["rodada_mensagem"] == rodada)
+        sucesso = valida & (marcas & MARCA_SUCESSO != 0)
+        fim_de_mensagem = valida & (marcas & MARCA_FIM_DE_MENSAGEM != 0)
+        posicao = host * num_rodadas + rodada
+
+        for nome, selecao, valores in [
+            ("tap", sucesso, pedaco["acesso_quadro"]),
+            ("tam", sucesso & fim_de_mensagem, pedaco["acesso_mensagem"]),
+            ("ncm", fim_de_mensagem, 1.0 * pedaco["colisoes"] / numpy.maximum(pedaco["quadros"], 1)),
+        ]:
+            somas[nome] += numpy.bincount(posicao[selecao], valores[selecao], minlength=len(somas[nome]))
+            contagens[nome] += numpy.bincount(posicao[selecao], minlength=len(contagens[nome]))
+
+        fora_do_transiente = rodada >= 1
+        for indice in xrange(num_hosts):
+            do_host = sucesso & fora_do_transiente & (host == indice)
+            histogramas_tap[indice].adicionar_amostras(pedaco["acesso_quadro"][do_host])
+            histogramas_tam[indice].adicionar_amostras(pedaco["acesso_mensagem"][do_host & fim_de_mensagem])
+
+        for ocupacao in ocupacoes:
+            ocupacao.acumular(pedaco, tempo[ultimos], fins[:rodada[-1]])
+
+    duracoes = numpy.diff(numpy.concatenate(([0.0], fins)))
+    confianca = metadados.get("nivel_de_confianca", 0.95)
+
+    def estatistica(valores):
+        # Médias das rodadas, sem a fase transiente
+        resultado = Estatisticas(confianca=confianca)
+        resultado.adicionar_amostras(valores[1:])
+        return resultado
+
+    def medias(nome):
+        soma = somas[nome].reshape(num_hosts, num_rodadas)
+        contagem = contagens[nome].reshape(num_hosts, num_rodadas)
+        return numpy.where(contagem > 0, soma / numpy.maximum(contagem, 1), 0.0)
+
+    def calcular_percentis(histograma):
+        if histograma.num_amostras() == 0:
+            return [numpy.nan for p in percentis]
+        return [histograma.quantil(p / 100.0) for p in percentis]
+
+    tap = medias("tap")
+    tam = medias("tam")
+    ncm = medias("ncm")
+    sucessos = contagens["tap"].reshape(num_hosts, num_rodadas)
+
+    resultado_hosts = []
+    for indice, hostname in enumerate(hosts):
+        resultado_hosts.append({
+            "hostname": hostname,
+            "ativo": metadados["ativos"][indice],
+            "tap": estatistica(tap[indice]),
+            "tam": estatistica(tam[indice]),
+            "ncm": estatistica(ncm[indice]),
+            "vazao": estatistica(1000000.0 * sucessos[indice] / duracoes),
+            "utilizacao": estatistica(ocupacoes[indice].ocupado / duracoes),
+            "percentis_tap": calcular_percentis(histogramas_tap[indice]),
+            "percentis_tam": calcular_percentis(histogramas_tam[indice]),
+        })
+
+    return {
+        "fins": fins,
+        "percentis": list(percentis),
+        "hosts": resultado_hosts,
+    }
+
+
+def imprimir_metricas(metricas):
+    print "%d rodadas (sem contar a fase transiente)" % (len(metricas["fins"]) - 1,)
+
+    def linha(nome, estatistica):
+        print "-%-18s=%13f | IC +-%13f" % (nome, estatistica.media(), estatistica.intervalo_de_confianca())
+
+    for i, host in enumerate(metricas["hosts"]):
+        linha("Uso Ether(%d)" % (i+1,), host["utilizacao"])
+        if not host["ativo"]:
+            continue
+        linha("Media do TAp(%d)" % (i+1,), host["tap"])
+        linha("Media do TAm(%d)" % (i+1,), host["tam"])
+        linha("Media do Ncm(%d)" % (i+1,), host["ncm"])
+        linha("Media da Vazao(%d)" % (i+1,), host["vazao"])
+        for nome, chave in (("TAp", "percentis_tap"), ("TAm", "percentis_tam")):
+            print "-Percentis %s(%d) %s" % (nome, i+1, "  ".join(
+                "p%g=%f" % (p, valor) for p, valor in zip(metricas["percentis"], host[chave])))
+
+
+def main():
+    parser = OptionParser(usage="%prog [opções] arquivo_de_trace")
+    parser.add_option("-t", "--tipo", action="append", metavar="EVENTO",
+        help="mostra apenas os eventos da classe EVENTO (pode ser repetida)")
+    parser.add_option("-m", "--host", action="append", metavar="HOSTNAME",
+        help="mostra apenas os eventos do host HOSTNAME, ou HUB (pode ser repetida)")
+    parser.add_option("-r", "--rodada", type="int", default=None,
+        help="mostra apenas os eventos da rodada RODADA (0 é a fase transiente)")
+    parser.add_option("--de", type="float", default=None, metavar="TEMPO",
+        help="mostra apenas os eventos a partir de TEMPO")
+    parser.add_option("--ate", type="float", default=None, metavar="TEMPO",
+        help="mostra apenas os eventos até TEMPO")
+    parser.add_option("-n", "--limite", type="int", default=None,
+        help="mostra no máximo LIMITE eventos")
+    parser.add_option("--resumo", action="store_true", default=False,
+        help="em vez dos eventos, mostra quantos eventos de cada tipo há em cada host")
+    parser.add_option("--metricas", action="store_true", default=False,
+        help="em vez dos eventos, recalcula as estatísticas da simulação "
+             "(os filtros não se aplicam)")
+    parser.add_option("-P", "--percentis", default="50,95,99",
+        help="percentis de TAp e TAm calculados com --metricas (padrão: 50,95,99)")
+    opcoes, argumentos = parser.parse_args()
+
+    if len(argumentos) != 1:
+        parser.print_help()
+        sys.exit(1)
+
+    metadados, registros = ler_trace(argumentos[0])
+    hosts = [hostname.encode("utf-8") for hostname in metadados["hosts"]]
+
+    print metadados["titulo"].encode("utf-8")
+
+    if opcoes.metricas:
+        try:
+            percentis = [float(p) for p in opcoes.percentis.split(",")]
+        except ValueError:
+            parser.error("percentis inválidos: %s" % (opcoes.percentis,))
+        imprimir_metricas(calcular_metricas(metadados, registros, percentis))
+        return
+
+    try:
+        codigos = codigos_dos_filtros(opcoes, hosts)
+    except ValueError, e:
+        parser.error("filtro inválido: %s" % (e,))
+
+    if opcoes.resumo:
+        imprimir_resumo(filtrar(registros, opcoes, codigos), hosts)
+    else:
+        imprimir_eventos(filtrar(registros, opcoes, codigos, opcoes.limite), hosts)
+
+if __name__ == "__main__":
+    main()
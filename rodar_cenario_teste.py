@@ -2,12 +2,8 @@
 # -*- coding: utf-8 -*-
 # vi:ts=4 sw=4 et
 
-import cPickle as pickle
-import sys
-
-import simulador
-reload(simulador)
 from simulador import *
+from execucao import linha_de_comando
 
 #uma máquina sozinha enviando para a rede
 def teste1():
@@ -241,41 +237,8 @@ cenarios = {
 }
 
 
-def print_help():
-    print "Digite: %s <cenário>" % (sys.argv[0],)
-    print "Cenários disponíveis: " + " ".join(sorted(cenarios.keys()))
-
-
 def main():
-    if len(sys.argv) != 2 or sys.argv[1] not in cenarios:
-        print_help()
-        sys.exit(1)
-
-    id = sys.argv[1]
-    file_prefix = "cenario_teste_%s" % (id,)
-
-    simulador = cenarios[id]()
-    simulador.start()
-    simulador.run()
-
-    # Salvando os resultados num arquivo
-    pickle.dump(simulador, file(file_prefix + ".pickle","wb"), protocol=2)
-    # Depois, é possível recarregar os resultados usando:
-    #   simulador = pickle.load(file("cenario_1.pickle","rb"))
-    # Depois de carregado, é possível acessar normalmente todos os
-    # membros do objeto simulador, e inclusive gerar novos gráficos.
-    # Só não é possível continuar/recomeçar a simulação.
-
-    # Salvando os gráficos num arquivo
-    simulador.gerar_graficos(layout="vertical")
-    simulador.salvar_graficos(file_prefix + ".png")
-    simulador.salvar_graficos(file_prefix + ".eps")
-    simulador.salvar_graficos(file_prefix + ".svg")
-    # Também é possível salvar em formatos .eps, .ps, .svg, .pdf
-
-    # Exibindo os gráficos na tela
-    simulador.gerar_graficos()
-    simulador.exibir_graficos()
+    linha_de_comando(cenarios, "cenario_teste_%s")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vi:ts=4 sw=4 et
+
+"""Executa em paralelo todos os cenários de rodar_cenario.py e de
+rodar_cenario_teste.py (substitui os scripts rodar_todos_os_cenarios.sh
+e rodar_todos_os_cenarios_teste.sh).
+
+Para cada cenário são gravados, como nos scripts originais, o arquivo
+.pickle, os gráficos e o relatório em texto (cenario_1.txt,
+cenario_teste_1.txt, ...). No final é impresso um resumo com as médias
+de todos os cenários.
+
+Os cenários que já estão no cache de resultados (ver
+execucao.CacheDeResultados) não são simulados de novo; apenas os seus
+arquivos são gerados outra vez."""
+
+# Os gráficos são gerados sem abrir nenhuma janela
+import matplotlib
+matplotlib.use("Agg")
+
+import sys
+import time
+
+from execucao import CacheDeResultados, OptionParser, executar_em_paralelo, salvar_resultados
+import rodar_cenario
+import rodar_cenario_teste
+
+
+# (módulo, prefixo dos arquivos gerados)
+MODULOS = [
+    ("rodar_cenario", "cenario_%s"),
+    ("rodar_cenario_teste", "cenario_teste_%s"),
+]
+
+
+def rodar(argumentos):
+    """Executa um cenário em um processo do pool, gravando todos os seus
+    arquivos. Retorna um resumo dos resultados."""
+
+    nome_modulo, prefixo, id, diretorio_cache = argumentos
+    file_prefix = prefixo % (id,)
+    modulo = sys.modules[nome_modulo]
+
+    wallclock_comeco = time.time()
+
+    stdout = sys.stdout
+    sys.stdout = file(file_prefix + ".txt", "w")
+    try:
+        simulador = modulo.cenarios[id]()
+        resultado = None
+        if diretorio_cache is not None:
+            cache = CacheDeResultados(diretorio_cache)
+            chave = simulador.chave_de_cache()
+            resultado = cache.carregar(chave)
+
+        if resultado is not None:
+            simulador = resultado
+            simulador.imprimir_relatorio()
+        else:
+            simulador.start()
+            simulador.run()
+            if diretorio_cache is not None:
+                cache.guardar(chave, simulador)
+
+        salvar_resultados(simulador, file_prefix)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    return {
+        "titulo": simulador.titulo,
+        "cache": resultado is not None,
+        "wallclock": time.time() - wallclock_comeco,
+        "rodadas": simulador.rodada_atual - 1,
+        "utilizacao": (simulador.utilizacao_global.media(), simulador.utilizacao_global.intervalo_de_confianca()),
+        "hosts": [
+            (host.hostname,
+             host.tap_global.media(), host.tam_global.media(),
+             host.ncm_global.media(), host.vazao_global.media())
+            for host in simulador.hosts if host.ativo
+        ],
+    }
+
+
+def imprimir_resumo(resumos):
+    print
+    print "%-22s %-6s %7s %9s %14s %14s %10s %10s" % (
+        "Cenário", "Host", "Rodadas", "Tempo(s)", "TAp (µs)", "TAm (µs)", "NCm", "Vazão")
+    for resumo in resumos:
+        titulo = resumo["titulo"].encode("utf-8")
+        print "%-22s %-6s %7d %9.1f   utilização do Ethernet = %f +- %f%s" % (
+            titulo, "", resumo["rodadas"], resumo["wallclock"],
+            resumo["utilizacao"][0], resumo["utilizacao"][1],
+            " (cache)" if resumo["cache"] else "")
+        for hostname, tap, tam, ncm, vazao in resumo["hosts"]:
+            print "%-22s %-6s %7s %9s %14.3f %14.3f %10.5f %10.3f" % (
+                "", hostname, "", "", tap, tam, ncm, vazao)
+
+
+def main():
+    parser = OptionParser(usage="%prog [opções]")
+    parser.add_option("-p", "--processos", type="int", default=None,
+        help="número de cenários executados ao mesmo tempo (padrão: número de CPUs)")
+    parser.add_option("--cache", metavar="DIRETORIO", default="cache_resultados",
+        help="diretório do cache de resultados (padrão: cache_resultados)")
+    parser.add_option("--sem-cache", action="store_true", default=False,
+        help="simula todos os cenários, sem usar o cache de resultados")
+    opcoes, argumentos = parser.parse_args()
+
+    if opcoes.sem_cache:
+        opcoes.cache = None
+
+    tarefas = [
+        (nome_modulo, prefixo, id, opcoes.cache)
+        for nome_modulo, prefixo in MODULOS
+        for id in sorted(sys.modules[nome_modulo].cenarios.keys())
+    ]
+
+    wallclock_comeco = time.time()
+
+    resumos = []
+    for resumo in executar_em_paralelo(rodar, tarefas, opcoes.processos):
+        nome_modulo, prefixo, id, diretorio_cache = tarefas[len(resumos)]
+        resumos.append(resumo)
+        print "== %s concluído ==" % (prefixo % (id,),)
+
+    imprimir_resumo(resumos)
+    print
+    print "Tempo real total: %.1f segundos" % (time.time() - wallclock_comeco,)
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,33 @@
 # -*- coding: utf-8 -*-
 # vi:ts=4 sw=4 et
 
+import bisect
+import collections
+import cPickle as pickle
+import hashlib
 import heapq
+import inspect
+import json
 import math
 import matplotlib.pyplot as pyplot
 import numpy
-import random
-import scipy.stats
+import os
+import struct
 import time
+import zlib
 
 
 ######################################################################
 # Funções úteis
 
+# Se True, imprime a descrição de cada evento processado (muito lento).
+# As chamadas a debug_print são sempre feitas dentro de um "if DEBUG:",
+# para que as mensagens nem sejam formatadas quando ele está desligado.
+DEBUG = False
+
 def debug_print(string):
     """Função de impressão, para debug"""
-    #print string
-    pass
+    print string
 
 def exibir_legenda():
     """Exibe a legenda no gráfico"""
@@ -30,36 +41,584 @@ def exibir_legenda():
         t.set_fontsize("x-small")
 
 
+######################################################################
+# Quantis da distribuição t de Student
+
+# Tabela t de Student, de 1 a 30 graus de liberdade, para os níveis de
+# confiança mais usados
+_TABELA_T_STUDENT = {
+    0.90: (
+        6.313752, 2.919986, 2.353363, 2.131847, 2.015048, 1.943180,
+        1.894579, 1.859548, 1.833113, 1.812461, 1.795885, 1.782288,
+        1.770933, 1.761310, 1.753050, 1.745884, 1.739607, 1.734064,
+        1.729133, 1.724718, 1.720743, 1.717144, 1.713872, 1.710882,
+        1.708141, 1.705618, 1.703288, 1.701131, 1.699127, 1.697261,
+    ),
+    0.95: (
+        12.706205, 4.302653, 3.182446, 2.776445, 2.570582, 2.446912,
+        2.364624, 2.306004, 2.262157, 2.228139, 2.200985, 2.178813,
+        2.160369, 2.144787, 2.131450, 2.119905, 2.109816, 2.100922,
+        2.093024, 2.085963, 2.079614, 2.073873, 2.068658, 2.063899,
+        2.059539, 2.055529, 2.051831, 2.048407, 2.045230, 2.042272,
+    ),
+    0.99: (
+        63.656741, 9.924843, 5.840909, 4.604095, 4.032143, 3.707428,
+        3.499483, 3.355387, 3.249836, 3.169273, 3.105807, 3.054540,
+        3.012276, 2.976843, 2.946713, 2.920782, 2.898231, 2.878440,
+        2.860935, 2.845340, 2.831360, 2.818756, 2.807336, 2.796940,
+        2.787436, 2.778715, 2.770683, 2.763262, 2.756386, 2.749996,
+    ),
+}
+
+# Quantis da normal padrão para os mesmos níveis de confiança
+_QUANTIS_NORMAL = {
+    0.90: 1.6448536269514722,
+    0.95: 1.959963984540054,
+    0.99: 2.5758293035489004,
+}
+
+# Quantis já calculados, indexados por (confiança, graus de liberdade)
+_cache_quantis_t = {}
+
+def quantil_t_student(confianca, graus_de_liberdade):
+    """Retorna o quantil da distribuição t de Student usado no intervalo
+    de confiança bilateral com o nível de confiança indicado. Por
+    exemplo, para confiança 0.95 retorna o quantil 0.975.
+
+    Os valores vêm da tabela acima, ou da expansão de Cornish-Fisher
+    (Abramowitz e Stegun, 26.7.5) acima de 30 graus de liberdade, cujo
+    erro é menor que 1e-6. Só para os outros níveis de confiança o
+    scipy é usado. Todo quantil calculado é guardado em cache."""
+
+    chave = (confianca, graus_de_liberdade)
+    try:
+        return _cache_quantis_t[chave]
+    except KeyError:
+        pass
+
+    if confianca in _TABELA_T_STUDENT and graus_de_liberdade <= 30:
+        valor = _TABELA_T_STUDENT[confianca][graus_de_liberdade - 1]
+    elif confianca in _QUANTIS_NORMAL:
+        z = _QUANTIS_NORMAL[confianca]
+        v = float(graus_de_liberdade)
+        valor = (z
+            + (z**3 + z) / 4 / v
+            + (5*z**5 + 16*z**3 + 3*z) / 96 / v**2
+            + (3*z**7 + 19*z**5 + 17*z**3 - 15*z) / 384 / v**3
+            + (79*z**9 + 776*z**7 + 1482*z**5 - 1920*z**3 - 945*z) / 92160 / v**4)
+    else:
+        import scipy.stats
+        valor = scipy.stats.t.ppf(1 - (1 - confianca) / 2.0, graus_de_liberdade)
+
+    _cache_quantis_t[chave] = valor
+    return valor
+
+
 ######################################################################
 # Estruturas auxiliares: Heap de eventos e coleta de estatísticas
 
-class HeapDeEventos(list):
-    """Implementação de uma fila com prioridades."""
+class FilaDeEventos(object):
+    """Comportamento comum a todas as filas de eventos.
 
-    def adicionar(self, tempo, evento):
-        heapq.heappush(self, (tempo, evento))
+    Todas as filas guardam tuplas (tempo, sequencia, evento). O número de
+    sequência desempata eventos com o mesmo tempo pela ordem de inserção,
+    de forma que a simulação é determinística e os objetos Evento nunca
+    são comparados entre si.
+
+    Eventos cancelados continuam guardados na fila (como "lápides") e
+    são descartados ao serem removidos. Se as lápides passarem a ocupar
+    boa parte da fila, ela é compactada."""
+
+    # A fila é compactada quando mais que esta fração dos eventos
+    # guardados estiver cancelada (e houver pelo menos MINIMO_COMPACTACAO
+    # eventos cancelados)
+    FRACAO_COMPACTACAO = 0.5
+    MINIMO_COMPACTACAO = 64
+
+    def __init__(self):
+        self.sequencia = 0
+        # Número de lápides guardadas na fila neste momento
+        self.cancelados = 0
+        # Número total de lápides já descartadas
+        self.descartados = 0
+
+    def cancelar(self, evento):
+        """Marca o evento como cancelado."""
+        evento.cancelado = True
+        self.cancelados += 1
+        if self.cancelados >= self.MINIMO_COMPACTACAO \
+        and self.cancelados > self.FRACAO_COMPACTACAO * len(self):
+            self.compactar()
+
+    def compactar(self):
+        """Remove todas as lápides da fila."""
+        self._compactar()
+        self.descartados += self.cancelados
+        self.cancelados = 0
 
     def remover(self):
-        """Retorna uma tupla (tempo, evento)"""
+        """Retorna uma tupla (tempo, evento), ignorando eventos cancelados"""
+        item = self._remover()
+        while item[2].cancelado:
+            self.cancelados -= 1
+            self.descartados += 1
+            item = self._remover()
+        return item[0], item[2]
+
+
+class HeapDeEventos(list, FilaDeEventos):
+    """Implementação de uma fila com prioridades usando um heap binário."""
+
+    def __init__(self):
+        list.__init__(self)
+        FilaDeEventos.__init__(self)
+
+    def adicionar(self, tempo, evento):
+        self.sequencia += 1
+        heapq.heappush(self, (tempo, self.sequencia, evento))
+
+    def _remover(self):
         return heapq.heappop(self)
 
+    def _compactar(self):
+        self[:] = [item for item in self if not item[2].cancelado]
+        heapq.heapify(self)
+
+
+class FilaDeCalendario(FilaDeEventos):
+    """Fila com prioridades do tipo "calendar queue" (Brown, 1988).
+
+    Os eventos são distribuídos em baldes, cada um correspondendo a um
+    "dia" de largura fixa de um "ano" circular. Enquanto a largura do
+    dia for compatível com o espaçamento entre os eventos, a inserção e
+    a remoção custam O(1) amortizado. O número de baldes e a largura do
+    dia são recalculados sempre que a fila dobra ou cai pela metade.
+
+    Cada balde é uma lista ordenada, consumida a partir da posição
+    guardada em 'inicios', de forma que a remoção não desloca os itens
+    restantes. Como quase todo evento novo é posterior aos que já estão
+    no seu balde, a inserção normalmente é um append; só os eventos fora
+    de ordem são inseridos por busca binária."""
+
+    # Número de eventos usados para estimar a largura do dia
+    AMOSTRA_LARGURA = 25
+    # Itens já consumidos que um balde acumula antes de ser encurtado
+    MAXIMO_CONSUMIDOS = 32
+
+    def __init__(self, largura=1.0):
+        FilaDeEventos.__init__(self)
+        self.tamanho = 0
+        self.ultimo_tempo = 0.0
+        self._configurar([], 2, largura)
+
+    def __len__(self):
+        return self.tamanho
+
+    def _itens(self):
+        """Retorna os itens ainda não consumidos de todos os baldes."""
+        return [item
+                for balde, inicio in zip(self.baldes, self.inicios)
+                for item in balde[inicio:]]
+
+    def _configurar(self, itens, num_baldes, largura):
+        """Redistribui os itens (já ordenados) em 'num_baldes' baldes
+        com a largura de dia indicada."""
+
+        self.num_baldes = num_baldes
+        self.largura = largura
+        self.baldes = [[] for i in xrange(num_baldes)]
+        self.inicios = [0] * num_baldes
+        for item in itens:
+            self.baldes[int(item[0] / largura) % num_baldes].append(item)
+
+        self.dia_atual = int(self.ultimo_tempo / largura)
+        self.limite_superior = 2 * num_baldes
+        self.limite_inferior = num_baldes / 2 - 2
+
+    def _redimensionar(self, num_baldes):
+        itens = sorted(self._itens())
+
+        # Estima a largura do dia como 3 vezes a separação média entre
+        # os primeiros eventos, desconsiderando separações muito grandes.
+        amostra = [item[0] for item in itens[:self.AMOSTRA_LARGURA]]
+        separacoes = [b - a for a, b in zip(amostra, amostra[1:])]
+        largura = self.largura
+        if separacoes:
+            media = sum(separacoes) / len(separacoes)
+            separacoes = [s for s in separacoes if s <= 2 * media]
+            if separacoes and sum(separacoes) > 0:
+                largura = 3.0 * sum(separacoes) / len(separacoes)
+
+        self._configurar(itens, num_baldes, largura)
 
-class Estatisticas(object):
-    """Coletor de amostras para geração e plotagem de estatísticas"""
+    def adicionar(self, tempo, evento):
+        self.sequencia += 1
+        item = (tempo, self.sequencia, evento)
+        indice = int(tempo / self.largura) % self.num_baldes
+        balde = self.baldes[indice]
+        # A sequência só cresce, então um item com tempo maior ou igual
+        # ao do último do balde já está em ordem
+        if not balde or tempo >= balde[-1][0]:
+            balde.append(item)
+        else:
+            bisect.insort(balde, item, self.inicios[indice])
+        self.tamanho += 1
+        if self.tamanho > self.limite_superior:
+            self._redimensionar(2 * self.num_baldes)
+
+    def _remover(self):
+        if self.tamanho == 0:
+            raise IndexError("remover de uma fila vazia")
+
+        baldes = self.baldes
+        inicios = self.inicios
+        num_baldes = self.num_baldes
+        largura = self.largura
+        dia = self.dia_atual
+
+        # Procura o próximo evento dentro de um "ano"
+        for i in xrange(num_baldes):
+            indice = dia % num_baldes
+            balde = baldes[indice]
+            inicio = inicios[indice]
+            if inicio < len(balde) and int(balde[inicio][0] / largura) <= dia:
+                break
+            dia += 1
+        else:
+            # Nenhum evento no próximo ano: busca direta pelo menor
+            indice = min(
+                (j for j in xrange(num_baldes) if inicios[j] < len(baldes[j])),
+                key=lambda j: baldes[j][inicios[j]])
+            balde = baldes[indice]
+            inicio = inicios[indice]
+            dia = int(balde[inicio][0] / largura)
+
+        item = balde[inicio]
+        inicio += 1
+        if inicio == len(balde):
+            del balde[:]
+            inicio = 0
+        elif inicio > self.MAXIMO_CONSUMIDOS:
+            del balde[:inicio]
+            inicio = 0
+        inicios[indice] = inicio
+
+        self.dia_atual = dia
+        self.ultimo_tempo = item[0]
+        self.tamanho -= 1
+        if self.tamanho < self.limite_inferior:
+            self._redimensionar(self.num_baldes / 2)
+
+        return item
+
+    def _compactar(self):
+        for i, balde in enumerate(self.baldes):
+            self.baldes[i] = [item for item in balde[self.inicios[i]:] if not item[2].cancelado]
+            self.inicios[i] = 0
+        self.tamanho -= self.cancelados
+
+
+class FilaEmEscada(FilaDeEventos):
+    """Fila com prioridades do tipo "ladder queue" (Tang, Goh e Thng,
+    2005).
+
+    Eventos distantes são apenas anexados, sem ordenação, ao "topo". Na
+    hora de remover, o topo é espalhado em "degraus" de baldes cada vez
+    mais finos, e só o balde mais próximo é ordenado no "fundo". Eventos
+    futuros próximos, como os atrasos de propagação deste modelo, caem
+    direto no degrau ou no fundo correspondente."""
+
+    # Baldes com mais eventos que isto são espalhados em um novo degrau
+    LIMIAR = 50
+    MAX_DEGRAUS = 8
+
+    def __init__(self):
+        FilaDeEventos.__init__(self)
+        self.tamanho = 0
+
+        self.topo = []
+        self.topo_inicio = 0.0
+        self.topo_max = 0.0
+
+        # Cada degrau é uma lista [inicio, largura, baldes, balde_atual]
+        self.degraus = []
+
+        # O fundo é uma lista ordenada, consumida a partir de fundo_pos
+        self.fundo = []
+        self.fundo_pos = 0
+
+    def __len__(self):
+        return self.tamanho
+
+    def adicionar(self, tempo, evento):
+        self.sequencia += 1
+        item = (tempo, self.sequencia, evento)
+        self.tamanho += 1
+
+        if tempo >= self.topo_inicio:
+            self.topo.append(item)
+            if tempo > self.topo_max:
+                self.topo_max = tempo
+            return
+
+        for degrau in self.degraus:
+            inicio, largura, baldes, atual = degrau
+            i = min(int((tempo - inicio) / largura), len(baldes) - 1)
+            if i >= atual:
+                baldes[i].append(item)
+                return
+
+        bisect.insort(self.fundo, item, self.fundo_pos)
+
+    def _criar_degrau(self, itens, inicio, fim):
+        """Espalha os itens em um novo degrau cobrindo [inicio, fim]."""
+        num_baldes = len(itens)
+        largura = (fim - inicio) / num_baldes
+        baldes = [[] for i in xrange(num_baldes)]
+        for item in itens:
+            i = min(max(int((item[0] - inicio) / largura), 0), num_baldes - 1)
+            baldes[i].append(item)
+        self.degraus.append([inicio, largura, baldes, 0])
+
+    def _preencher_fundo(self):
+        while True:
+            if not self.degraus:
+                itens = self.topo
+                self.topo = []
+                self.topo_inicio = self.topo_max
+                minimo = min(item[0] for item in itens)
+                if len(itens) <= self.LIMIAR or minimo == self.topo_max:
+                    itens.sort()
+                    self.fundo = itens
+                    self.fundo_pos = 0
+                    return
+                self._criar_degrau(itens, minimo, self.topo_max)
+                continue
+
+            degrau = self.degraus[-1]
+            inicio, largura, baldes, atual = degrau
+            while atual < len(baldes) and not baldes[atual]:
+                atual += 1
+            if atual == len(baldes):
+                self.degraus.pop()
+                continue
+
+            itens = baldes[atual]
+            baldes[atual] = []
+            degrau[3] = atual + 1
+
+            minimo = min(item[0] for item in itens)
+            maximo = max(item[0] for item in itens)
+            if len(itens) > self.LIMIAR and minimo < maximo \
+            and len(self.degraus) < self.MAX_DEGRAUS:
+                self._criar_degrau(itens, minimo, maximo)
+                continue
+
+            itens.sort()
+            self.fundo = itens
+            self.fundo_pos = 0
+            return
 
-    def __init__(self, titulo=u"Estatísticas"):
+    def _remover(self):
+        if self.tamanho == 0:
+            raise IndexError("remover de uma fila vazia")
+
+        if self.fundo_pos == len(self.fundo):
+            self._preencher_fundo()
+
+        item = self.fundo[self.fundo_pos]
+        self.fundo_pos += 1
+        self.tamanho -= 1
+        return item
+
+    def _compactar(self):
+        filtrar = lambda itens: [item for item in itens if not item[2].cancelado]
+        self.topo = filtrar(self.topo)
+        for degrau in self.degraus:
+            degrau[2] = [filtrar(balde) for balde in degrau[2]]
+        self.fundo = filtrar(self.fundo[self.fundo_pos:])
+        self.fundo_pos = 0
+        self.tamanho -= self.cancelados
+
+
+# Implementações de fila de eventos que podem ser escolhidas no Simulador
+ESCALONADORES = {
+    "heap": HeapDeEventos,
+    "calendario": FilaDeCalendario,
+    "escada": FilaEmEscada,
+}
+
+
+class Estatisticas(object):
+    """Coletor de amostras para geração e plotagem de estatísticas.
+
+    A média e a variância são calculadas incrementalmente (método de
+    Welford), sem depender das amostras guardadas. O parâmetro
+    'max_amostras' controla quantas amostras são guardadas para os
+    gráficos:
+    - None: todas as amostras são guardadas;
+    - 0: nenhuma amostra é guardada;
+    - N: no máximo N amostras igualmente espaçadas são guardadas. Quando
+      o limite é atingido, metade delas é descartada e o espaçamento
+      entre as amostras guardadas dobra.
+
+    Estatísticas parciais (de outras rodadas ou de outros processos)
+    podem ser combinadas com combinar(), e blocos de amostras em arrays
+    do NumPy podem ser adicionados de uma vez com adicionar_amostras().
+    Em ambos os casos os momentos são combinados pela fórmula de Chan et
+    al., que é numericamente estável."""
+
+    def __init__(self, titulo=u"Estatísticas", max_amostras=None, confianca=0.95):
         self.amostras = []
         self.intervalos = []
-        self.soma_amostras = 0
-        self.soma_quadrados = 0
         self.num_amostras = 0
+        self.media_acumulada = 0.0
+        # Soma dos quadrados dos desvios em relação à média
+        self.m2 = 0.0
+        self.ultima_amostra = 0
         self.titulo = titulo
+        # Nível de confiança padrão de intervalo_de_confianca()
+        self.confianca = confianca
+        # Último intervalo calculado: (num_amostras, confiança, valor)
+        self.intervalo_calculado = None
+
+        self.max_amostras = max_amostras
+        self.guardar_amostras = (max_amostras != 0)
+        # Somente uma a cada 'passo' amostras é guardada
+        self.passo = 1
 
     def adicionar_amostra(self, amostra):
-        self.amostras.append(amostra)
-        self.soma_amostras += amostra
-        self.soma_quadrados += amostra*amostra
         self.num_amostras += 1
+        delta = amostra - self.media_acumulada
+        self.media_acumulada += delta / self.num_amostras
+        self.m2 += delta * (amostra - self.media_acumulada)
+        self.ultima_amostra = amostra
+
+        if self.guardar_amostras and (self.num_amostras - 1) % self.passo == 0:
+            self.amostras.append(amostra)
+            if len(self.amostras) == self.max_amostras:
+                del self.amostras[1::2]
+                self.passo *= 2
+
+    def reiniciar(self):
+        """Descarta todas as amostras e intervalos."""
+
+        self.amostras = []
+        self.intervalos = []
+        self.num_amostras = 0
+        self.media_acumulada = 0.0
+        self.m2 = 0.0
+        self.ultima_amostra = 0
+        self.passo = 1
+        self.intervalo_calculado = None
+
+    def juntar_pares(self):
+        """Substitui cada par de amostras consecutivas pela média do par
+        (se o número de amostras for ímpar, a última é mantida). No
+        método das médias em lotes, equivale a dobrar o tamanho dos lotes
+        já coletados. Só funciona se todas as amostras foram guardadas."""
+
+        amostras = self.amostras
+        juntas = [(a + b) / 2.0 for a, b in zip(amostras[0::2], amostras[1::2])]
+        if len(amostras) % 2 == 1:
+            juntas.append(amostras[-1])
+
+        self.reiniciar()
+        self.adicionar_amostras(juntas)
+
+    def refazer_medias(self, lotes):
+        """Substitui as amostras e os intervalos pela evolução da média e
+        do intervalo de confiança de 'lotes', como se os lotes tivessem
+        sido registrados um a um (ver Host.registrar_rodada). Usado para
+        refazer as séries *_global_media depois de juntar_pares()."""
+
+        parcial = Estatisticas(max_amostras=0, confianca=lotes.confianca)
+        self.reiniciar()
+        for amostra in lotes.amostras:
+            parcial.adicionar_amostra(amostra)
+            self.adicionar_amostra(parcial.media())
+            self.adicionar_intervalo(parcial.intervalo_de_confianca())
+
+    def autocorrelacao(self, lag=1):
+        """Retorna a autocorrelação das amostras guardadas com o 'lag'
+        indicado (ou 0 se houver amostras de menos)."""
+
+        if len(self.amostras) < lag + 2:
+            return 0.0
+
+        desvios = numpy.asarray(self.amostras, dtype=float)
+        desvios -= desvios.mean()
+        variacao = (desvios * desvios).sum()
+        if variacao == 0:
+            return 0.0
+        return float((desvios[:-lag] * desvios[lag:]).sum() / variacao)
+
+    def _combinar_momentos(self, num_amostras, media, m2):
+        """Combina os momentos atuais com os de outro conjunto de amostras
+        (ref: http://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Parallel_algorithm)"""
+
+        if num_amostras == 0:
+            return
+
+        n = self.num_amostras + num_amostras
+        delta = media - self.media_acumulada
+        self.media_acumulada += delta * num_amostras / n
+        self.m2 += m2 + delta * delta * self.num_amostras * num_amostras / n
+        self.num_amostras = n
+
+    def _guardar_amostras(self, valores, primeira, passo=1, num_amostras=None):
+        """Guarda as amostras que caem no espaçamento atual. 'valores' são
+        amostras espaçadas de 'passo', de um trecho de 'num_amostras'
+        amostras (por padrão, len(valores)) que começa na posição
+        'primeira'. Se 'passo' for maior que o espaçamento atual, este é
+        aumentado até ele; se as posições não se alinharem, é guardada a
+        última amostra de 'valores' antes de cada posição."""
+
+        if not self.guardar_amostras:
+            return
+        if num_amostras is None:
+            num_amostras = len(valores)
+
+        while self.passo < passo:
+            del self.amostras[1::2]
+            self.passo *= 2
+        deslocamento = (-primeira) % self.passo
+        num_posicoes = len(xrange(deslocamento, num_amostras, self.passo))
+        self.amostras.extend(valores[deslocamento // passo::self.passo // passo][:num_posicoes])
+        while self.max_amostras is not None and len(self.amostras) >= self.max_amostras:
+            del self.amostras[1::2]
+            self.passo *= 2
+
+    def adicionar_amostras(self, valores):
+        """Adiciona de uma vez todas as amostras de um array (ou de
+        qualquer sequência de números)."""
+
+        valores = numpy.asarray(valores, dtype=float)
+        if len(valores) == 0:
+            return
+
+        media = valores.mean()
+        m2 = ((valores - media) ** 2).sum()
+
+        primeira = self.num_amostras
+        self._combinar_momentos(len(valores), float(media), float(m2))
+        self.ultima_amostra = float(valores[-1])
+        self._guardar_amostras(valores.tolist(), primeira)
+
+    def combinar(self, outra):
+        """Incorpora as amostras de outra Estatisticas, como se elas
+        tivessem sido adicionadas a esta. As amostras guardadas pela
+        outra são reamostradas no espaçamento atual (ver _guardar_amostras);
+        para que as amostras guardadas continuem igualmente espaçadas, a
+        outra também precisa guardá-las (max_amostras diferente de 0)."""
+
+        if outra.num_amostras == 0:
+            return
+
+        primeira = self.num_amostras
+        self._combinar_momentos(outra.num_amostras, outra.media_acumulada, outra.m2)
+        self.ultima_amostra = outra.ultima_amostra
+        self._guardar_amostras(outra.amostras, primeira, outra.passo, outra.num_amostras)
 
     def adicionar_intervalo(self, intervalo):
         self.intervalos.append(intervalo)
@@ -72,7 +631,7 @@ class Estatisticas(object):
         if len(self.amostras) == 0:
             return
 
-        x = numpy.arange(1, self.num_amostras+1)
+        x = numpy.arange(len(self.amostras)) * self.passo + 1
         if len(self.amostras) != len(self.intervalos):
             plot = pyplot.plot(x, self.amostras, *args, **kwargs)
         else:
@@ -86,119 +645,426 @@ class Estatisticas(object):
         if self.num_amostras == 0:
             return 0
 
-        return self.soma_amostras / self.num_amostras
+        return self.media_acumulada
 
     def variancia(self):
         """Retorna a variância das amostras"""
         if self.num_amostras < 2:
             return 0
 
-        #ref: http://en.wikipedia.org/wiki/Variance#Population_variance_and_sample_variance
-        sq = self.soma_quadrados
-        sa = self.soma_amostras
-        n = self.num_amostras
-
-        # Usando abs() para evitar resultado -0.0000 devido a erros de ponto flutuante 
-        return abs( (sq / (n - 1)) - ((sa * sa) / (n * (n - 1))) )
+        #ref: http://en.wikipedia.org/wiki/Algorithms_for_calculating_variance
+        return self.m2 / (self.num_amostras - 1)
 
-    def intervalo_de_confianca(self):
+    def intervalo_de_confianca(self, confianca=None):
         """Retorna metade do tamanho do intervalo de confiança, ou seja,
         o intervalo será definido pela média +- o valor retornado por
-        esta função"""
+        esta função. O valor só é recalculado quando chegam novas
+        amostras."""
 
         if self.num_amostras < 2:
             return 0
 
-        # 1 - 95% = 5%
-        # 5% / 2 = 2.5%
-        # 1 - 2.5% = 97.5% = 0.975
-        t_student_95 = scipy.stats.t.ppf(0.975, self.num_amostras-1)
+        if confianca is None:
+            confianca = self.confianca
 
-        return t_student_95 * math.sqrt(self.variancia() / self.num_amostras)
+        calculado = self.intervalo_calculado
+        if calculado is not None and calculado[0] == self.num_amostras and calculado[1] == confianca:
+            return calculado[2]
 
-    def precisao_suficiente(self):
+        t_student = quantil_t_student(confianca, self.num_amostras-1)
+        valor = t_student * math.sqrt(self.variancia() / self.num_amostras)
+
+        self.intervalo_calculado = (self.num_amostras, confianca, valor)
+        return valor
+
+    def precisao_suficiente(self, precisao_relativa=0.10, precisao_absoluta=None, confianca=None):
         """Retorna True ou False, indicando se a largura do intervalo de
-        confiança é menor que 10% da média das amostras."""
+        confiança é no máximo 'precisao_relativa' vezes a média das
+        amostras (por padrão, 10% da média) ou no máximo
+        'precisao_absoluta'. Cada precisão pode ser None para ser
+        ignorada."""
 
         if self.num_amostras < 2:
             return False
 
-        return 2 * self.intervalo_de_confianca() <= self.media() / 10.0
+        largura = 2 * self.intervalo_de_confianca(confianca)
+        if precisao_relativa is not None and largura <= precisao_relativa * abs(self.media()):
+            return True
+        if precisao_absoluta is not None and largura <= precisao_absoluta:
+            return True
+        return False
+
+
+class HistogramaLog(object):
+    """Histograma de amostras positivas com classes de largura constante
+    em escala logarítmica, de 'minimo' a 'maximo', com
+    'classes_por_decada' classes em cada potência de 10.
+
+    As amostras menores que 'minimo' (inclusive os zeros) são contadas
+    na primeira posição de 'contagens', e as maiores que 'maximo' na
+    última. Histogramas com os mesmos limites podem ser somados com
+    combinar().
+
+    As amostras são acumuladas em uma lista e contadas em blocos de
+    AMOSTRAS_POR_BLOCO com o NumPy; descarregar() conta as pendentes.
+    Um array de amostras pode ser contado de uma vez com
+    adicionar_amostras()."""
+
+    AMOSTRAS_POR_BLOCO = 1024
+
+    def __init__(self, minimo=0.1, maximo=1e9, classes_por_decada=20):
+        self.minimo = minimo
+        self.maximo = maximo
+        self.classes_por_decada = classes_por_decada
+        num_classes = int(math.ceil(math.log10(maximo / minimo) * classes_por_decada))
+        self.limites = minimo * 10.0 ** (numpy.arange(num_classes + 1) / float(classes_por_decada))
+        self.contagens = numpy.zeros(num_classes + 2, dtype=numpy.int64)
+        self.pendentes = []
+
+    def adicionar_amostra(self, amostra):
+        self.pendentes.append(amostra)
+        if len(self.pendentes) >= self.AMOSTRAS_POR_BLOCO:
+            self.descarregar()
+
+    def descarregar(self):
+        if not self.pendentes:
+            return
+
+        amostras = self.pendentes
+        self.pendentes = []
+        self.adicionar_amostras(amostras)
+
+    def adicionar_amostras(self, amostras):
+        amostras = numpy.asarray(amostras, dtype=float)
+        classes = numpy.empty(len(amostras), dtype=int)
+        abaixo = amostras < self.minimo
+        acima = amostras >= self.maximo
+        dentro = ~(abaixo | acima)
+        classes[abaixo] = 0
+        classes[acima] = len(self.contagens) - 1
+        classes[dentro] = 1 + (numpy.log10(amostras[dentro] / self.minimo) * self.classes_por_decada).astype(int)
+        self.contagens += numpy.bincount(classes, minlength=len(self.contagens))
+
+    def combinar(self, contagens):
+        """Soma ao histograma as 'contagens' de outro histograma com os
+        mesmos limites."""
+
+        self.contagens += contagens
+
+    def reiniciar(self):
+        self.contagens[:] = 0
+        self.pendentes = []
+
+    def num_amostras(self):
+        self.descarregar()
+        return int(self.contagens.sum())
+
+    def quantil(self, p):
+        """Retorna o quantil 'p' (entre 0 e 1), interpolado
+        geometricamente dentro da classe onde ele cai. As amostras menores
+        que 'minimo' são consideradas iguais a zero."""
+
+        self.descarregar()
+        total = self.contagens.sum()
+        if total == 0:
+            return 0.0
+
+        acumuladas = numpy.cumsum(self.contagens)
+        alvo = p * total
+        classe = int(numpy.searchsorted(acumuladas, alvo))
+        if classe == 0:
+            return 0.0
+        if classe == len(self.contagens) - 1:
+            return self.maximo
+
+        anteriores = acumuladas[classe - 1]
+        fracao = (alvo - anteriores) / float(self.contagens[classe])
+        inferior = self.limites[classe - 1]
+        superior = self.limites[classe]
+        return float(inferior * (superior / inferior) ** fracao)
+
+
+class Quantis(object):
+    """Estima os 'percentis' (de 0 a 100) de uma medida do simulador,
+    como o TAp de um host, sem guardar as amostras.
+
+    As amostras de cada rodada são contadas em um HistogramaLog. No
+    final da rodada, os percentis do histograma da rodada entram em
+    'lotes' e o histograma da rodada é somado ao histograma global.
+
+    O valor de cada percentil é calculado pelo histograma global, com
+    todas as amostras, e o intervalo de confiança pela variância dos
+    percentis das rodadas (método das médias em lotes), ambos com o
+    mesmo estimador. A média dos percentis das rodadas não é usada como
+    valor porque, com poucas amostras por rodada, os percentis altos de
+    cada rodada ficam sistematicamente abaixo do percentil de todas as
+    amostras.
+
+    Sem nenhum percentil, nenhuma amostra é contada."""
+
+    def __init__(self, percentis=(50, 95, 99), confianca=0.95):
+        self.percentis = tuple(percentis)
+        self.lotes = [Estatisticas(confianca=confianca) for p in self.percentis]
+        self.histograma_global = None
+        self.histograma_rodada = None
+        if self.percentis:
+            self.histograma_global = HistogramaLog()
+            self.histograma_rodada = HistogramaLog()
+
+    def reiniciar_rodada(self):
+        if self.histograma_rodada is not None:
+            self.histograma_rodada.reiniciar()
+
+    def adicionar_amostra(self, amostra):
+        if self.histograma_rodada is not None:
+            self.histograma_rodada.adicionar_amostra(amostra)
+
+    def finalizar_rodada(self):
+        """Registra os percentis da rodada. Rodadas sem nenhuma amostra
+        são ignoradas."""
+
+        if self.histograma_rodada is None or self.histograma_rodada.num_amostras() == 0:
+            return
+        for lote, p in zip(self.lotes, self.percentis):
+            lote.adicionar_amostra(self.histograma_rodada.quantil(p / 100.0))
+        self.histograma_global.combinar(self.histograma_rodada.contagens)
+        self.histograma_rodada.reiniciar()
+
+    def valor(self, i):
+        """Retorna o i-ésimo percentil de todas as amostras, calculado
+        pelo histograma global."""
+
+        return self.histograma_global.quantil(self.percentis[i] / 100.0)
+
+    def intervalo_de_confianca(self, i):
+        """Retorna metade do tamanho do intervalo de confiança do
+        i-ésimo percentil."""
+
+        return self.lotes[i].intervalo_de_confianca()
+
+    def juntar_pares(self):
+        """Agrupa os percentis das rodadas dois a dois, junto com os
+        lotes das outras estatísticas (ver Simulador.juntar_lotes)."""
+
+        for lote in self.lotes:
+            lote.juntar_pares()
+
+    def amostras(self):
+        """Retorna os percentis das rodadas e o histograma global, num
+        formato compacto que pode ser enviado entre processos."""
+
+        if self.histograma_global is None:
+            return ([], None)
+        self.histograma_global.descarregar()
+        return ([lote.amostras for lote in self.lotes], self.histograma_global.contagens)
+
+    def incorporar(self, amostras):
+        """Adiciona os percentis das rodadas e o histograma de outra
+        replicação, no formato retornado por amostras()."""
+
+        estimativas, contagens = amostras
+        for lote, valores in zip(self.lotes, estimativas):
+            for valor in valores:
+                lote.adicionar_amostra(valor)
+        if contagens is not None:
+            self.histograma_global.combinar(contagens)
+
+
+def truncamento_mser5(serie):
+    """Calcula o ponto de truncamento da fase transiente de uma série de
+    observações pelo método MSER-5 (White, 1997).
+
+    As observações são agrupadas em lotes de 5, e o truncamento d é o
+    número de lotes iniciais descartados que minimiza o erro padrão da
+    média dos lotes restantes. Retorna d convertido em número de
+    observações, ou None se o mínimo ainda está na segunda metade da
+    série (ou seja, ela ainda não é longa o bastante para indicar o
+    estado estacionário)."""
+
+    num_lotes = len(serie) // 5
+    if num_lotes < 10:
+        return None
+
+    lotes = numpy.asarray(serie[:num_lotes * 5], dtype=float).reshape(num_lotes, 5).mean(axis=1)
+
+    # Somas dos lotes restantes para cada truncamento d = 0..num_lotes-1
+    soma = numpy.cumsum(lotes[::-1])[::-1]
+    soma_quadrados = numpy.cumsum((lotes * lotes)[::-1])[::-1]
+    restantes = numpy.arange(num_lotes, 0, -1, dtype=float)
+    mser = (soma_quadrados - soma * soma / restantes) / (restantes * restantes)
+
+    # Os últimos truncamentos deixam poucos lotes e não são confiáveis
+    d = int(numpy.argmin(mser[:num_lotes - 2]))
+    if d > num_lotes / 2:
+        return None
+    return d * 5
 
 
 ######################################################################
-# As funções a seguir são usadas na definição dos parâmetros de cada
-# Host, na inicialização do simulador.
+# As classes a seguir são usadas na definição dos parâmetros de cada
+# Host, na inicialização do simulador. Cada objeto é chamado sem
+# parâmetros e retorna o próximo valor sorteado.
+
+class Distribuicao(object):
+    """Classe base dos geradores de números aleatórios.
 
-def Exponencial(intervalo):
+    Cada objeto tem o seu próprio gerador (numpy.random.RandomState), de
+    forma que cada host e cada finalidade (chegadas, número de quadros,
+    backoff) usa uma sequência independente, que pode ser reproduzida
+    com semear(). Os valores são sorteados em blocos de TAMANHO_BLOCO
+    pelo NumPy e entregues um a um, evitando o custo de uma chamada ao
+    NumPy por valor."""
+
+    TAMANHO_BLOCO = 4096
+
+    def __init__(self):
+        self.gerador = numpy.random.RandomState()
+        self.bloco = []
+
+    def semear(self, semente):
+        """Reinicia a sequência de valores a partir da semente (um inteiro
+        ou uma sequência de inteiros)."""
+        self.gerador = numpy.random.RandomState(semente)
+        self.bloco = []
+
+    def sortear_bloco(self, tamanho):
+        """Retorna um array com 'tamanho' valores sorteados."""
+        raise NotImplementedError()
+
+    def __call__(self):
+        try:
+            return self.bloco.pop()
+        except IndexError:
+            # Guardado em ordem inversa, já que pop() tira do final
+            self.bloco = self.sortear_bloco(self.TAMANHO_BLOCO)[::-1].tolist()
+            return self.bloco.pop()
+
+
+class Exponencial(Distribuicao):
     """Gerador de tempo exponencial com média igual a 'intervalo'."""
-    return lambda: random.expovariate(1.0/intervalo)
 
-def Deterministica(valor):
+    def __init__(self, intervalo):
+        Distribuicao.__init__(self)
+        self.intervalo = intervalo
+
+    def sortear_bloco(self, tamanho):
+        return self.gerador.exponential(self.intervalo, tamanho)
+
+
+class Deterministica(Distribuicao):
     """Gerador deterministico de tempos ou número de quadros."""
-    return lambda: valor
 
-def Geometrica(probabilidade):
+    def __init__(self, valor):
+        Distribuicao.__init__(self)
+        self.valor = valor
+
+    def __call__(self):
+        return self.valor
+
+
+class Geometrica(Distribuicao):
     """Gerador de distribuição geométrica."""
-    return lambda: numpy.random.geometric(probabilidade)
 
+    def __init__(self, probabilidade):
+        Distribuicao.__init__(self)
+        self.probabilidade = probabilidade
 
-######################################################################
-# Coisas que encapsulam a interface do Host
+    def sortear_bloco(self, tamanho):
+        return self.gerador.geometric(self.probabilidade, tamanho)
 
-class Mensagem(object):
-    """Representa uma mensagem a ser enviada."""
 
-    def __init__(self, rodada, num_quadros):
-        self.rodada = rodada
-        self.num_quadros = num_quadros
+class Backoff(Distribuicao):
+    """Gerador do número de fatias de espera do binary backoff."""
+
+    def sortear_bloco(self, tamanho):
+        return self.gerador.random_sample(tamanho)
+
+    def sortear(self, k):
+        """Sorteia um inteiro uniforme entre 0 e 2**k - 1."""
+        return int(self() * (1 << k))
+
 
+def distribuicao_num_quadros(num_quadros):
+    """Retorna a distribuição do número de quadros de cada mensagem a
+    partir do parâmetro num_quadros do Host."""
+
+    if callable(num_quadros) or num_quadros is None:
+        # Se o tipo de distribuição foi definido explicitamente:
+        return num_quadros
+    else:
+        # Caso contrário, auto-detectar o tipo de distribuição através
+        # do número passado
+        if num_quadros < 1:
+            # O número passado é uma probabilidade
+            return Geometrica(num_quadros)
+        else:
+            # O número passado é uma quantidade constante
+            # (determinística) de quadros.
+            # Cuidado! Não é tratado o caso do número de quadros ser
+            # fracionário!
+            return Deterministica(num_quadros)
+
+
+######################################################################
+# Coisas que encapsulam a interface do Host
 
 class Host(object):
     """Representa uma máquina."""
 
-    def __init__(self, hostname, distancia, chegada, num_quadros):
+    def __init__(self, hostname, distancia, chegada, num_quadros, capacidade_fila=None):
         """Recebe os parâmetros do host:
-        hostname = Nome da máquina (ignorado pelo simulador)
+        hostname = Nome da máquina (também identifica as sequências
+                   aleatórias do host, ver Simulador.semear)
         dist = Distância deste host ao hub (medida em metros)
         chegada = Processo de chegada das mensagens a ser enviadas
-        num_quadros = Distribuição do número de quadros para cada mensagem"""
+        num_quadros = Distribuição do número de quadros para cada mensagem
+        capacidade_fila = Número máximo de mensagens na fila, incluindo a
+                          que está sendo enviada (None para ilimitado); as
+                          mensagens que chegam com a fila cheia são
+                          descartadas"""
 
         self.hostname = hostname
         self.distancia = distancia
         self.chegada = chegada
+        self.capacidade_fila = capacidade_fila
         # Estes dois campos campos serão definidos mais abaixo
         #self.num_quadros = num_quadros
         #self.ativo = (chegada and num_quadros)
 
-        if callable(num_quadros) or num_quadros is None:
-            # Se o tipo de distribuição foi definido explicitamente:
-            self.num_quadros = num_quadros
-        else:
-            # Caso contrário, auto-detectar o tipo de distribuição através
-            # do número passado
-            if num_quadros < 1:
-                # O número passado é uma probabilidade
-                self.num_quadros = Geometrica(num_quadros)
-            else:
-                # O número passado é uma quantidade constante
-                # (determinística) de quadros.
-                # Cuidado! Não é tratado o caso do número de quadros ser
-                # fracionário!
-                self.num_quadros = Deterministica(num_quadros)
+        self.num_quadros = distribuicao_num_quadros(num_quadros)
 
         # Um host é considerado ativo se ele gera tráfego. Ou seja, se
         # ele tem uma distribuição de chegada de mensagens e de número
         # de quadros de cada mensagem.
         self.ativo = callable(self.chegada) and callable(self.num_quadros)
 
-    def reset(self):
+        self.backoff = Backoff()
+
+    def semear(self, semente):
+        """Reinicia as sequências aleatórias do host (chegadas, número de
+        quadros e backoff), cada uma com uma semente derivada de
+        'semente' (um inteiro ou uma lista de inteiros)."""
+
+        if isinstance(semente, (int, long)):
+            semente = [semente]
+        for i, distribuicao in enumerate([self.chegada, self.num_quadros, self.backoff]):
+            if isinstance(distribuicao, Distribuicao):
+                distribuicao.semear(list(semente) + [i])
+
+    def reset(self, confianca=0.95, percentis=(50, 95, 99)):
         """Faz um "reset" no host, reiniciando todas as estatísticas e o
         estado do host. Este método deve ser chamado antes de começar a
-        simulação."""
-
-        # Fila de mensagens
-        self.fila = []
+        simulação. 'confianca' é o nível de confiança dos intervalos das
+        estatísticas globais, e 'percentis' são os percentis de TAp e TAm
+        estimados (ver Quantis)."""
+
+        # Fila de mensagens, cada uma representada por uma tupla
+        # (rodada, num_quadros)
+        self.fila = collections.deque()
+        # Mensagens descartadas por chegarem com a fila cheia e quadros
+        # descartados após 16 tentativas, desde o começo da simulação
+        self.mensagens_descartadas = 0
+        self.quadros_descartados = 0
         # Número do próximo quadro (dentro da mensagem atual) a ser enviado
         self.proximo_quadro = 0
 
@@ -211,63 +1077,155 @@ class Host(object):
 
         # Flag para indicar se o host está enviando algum quadro
         self.enviando = False
+        # O host vê o Ethernet ocupado enquanto está transmitindo ou
+        # recebendo. Cada intervalo ocupado é somado em tempo_ocupado
+        # quando termina; comeco_ocupado é o começo do intervalo atual
+        self.tempo_ocupado = 0.0
+        self.comeco_ocupado = 0.0
         # Flag para indicar se o host está esperando o tempo do binary backoff
         self.agendado = False
         self.contador_colisoes = 0
 
-        self.tap_global = Estatisticas()
-        self.tam_global = Estatisticas()
-        self.ncm_global = Estatisticas()
-        self.vazao_global = Estatisticas()
-
-        self.tap_global_media = Estatisticas()
-        self.tam_global_media = Estatisticas()
-        self.ncm_global_media = Estatisticas()
-        self.vazao_global_media = Estatisticas()
+        # Modo de difusão analítica: bordas de portadora (ligando ou
+        # desligando) que ainda vão chegar a este host, em ordem de tempo
+        self.bordas = collections.deque()
+        # Flag para indicar se já existe um DespertarHost na fila de eventos
+        self.despertar_agendado = False
+
+        self.tap_global = Estatisticas(confianca=confianca)
+        self.tam_global = Estatisticas(confianca=confianca)
+        self.ncm_global = Estatisticas(confianca=confianca)
+        self.vazao_global = Estatisticas(confianca=confianca)
+        # Tamanho médio da fila (média no tempo), fração das mensagens
+        # descartadas por chegarem com a fila cheia e fração dos quadros
+        # descartados após 16 tentativas de transmissão
+        self.fila_global = Estatisticas(confianca=confianca)
+        self.descarte_global = Estatisticas(confianca=confianca)
+        self.perdidos_global = Estatisticas(confianca=confianca)
+        # Fração do tempo em que o host viu o Ethernet ocupado
+        self.utilizacao_global = Estatisticas(confianca=confianca)
+
+        self.tap_global_media = Estatisticas(confianca=confianca)
+        self.tam_global_media = Estatisticas(confianca=confianca)
+        self.ncm_global_media = Estatisticas(confianca=confianca)
+        self.vazao_global_media = Estatisticas(confianca=confianca)
+        self.fila_global_media = Estatisticas(confianca=confianca)
+        self.descarte_global_media = Estatisticas(confianca=confianca)
+        self.perdidos_global_media = Estatisticas(confianca=confianca)
+        self.utilizacao_global_media = Estatisticas(confianca=confianca)
+
+        self.tap_quantis = Quantis(percentis, confianca=confianca)
+        self.tam_quantis = Quantis(percentis, confianca=confianca)
 
         self.reiniciar_estatisticas()
 
-    def reiniciar_estatisticas(self):
+    def reiniciar_estatisticas(self, tempo_agora=0.0):
         """Reinicia as estatísticas no início de uma rodada."""
 
-        self.tap_rodada = Estatisticas()
-        self.tam_rodada = Estatisticas()
-        self.ncm_rodada = Estatisticas()
+        # Só as médias das rodadas são necessárias; as amostras
+        # individuais não são guardadas
+        self.tap_rodada = Estatisticas(max_amostras=0)
+        self.tam_rodada = Estatisticas(max_amostras=0)
+        self.ncm_rodada = Estatisticas(max_amostras=0)
+        self.tap_quantis.reiniciar_rodada()
+        self.tam_quantis.reiniciar_rodada()
 
         self.quadros_com_sucesso = 0
+        self.quadros_perdidos = 0
+        self.mensagens_chegadas = 0
+        self.mensagens_descartadas_rodada = 0
 
-    def precisao_suficiente(self):
-        """Indica se as estatísticas coletadas neste host já possuem a
-        precisão desejada."""
+        # Integral do tamanho da fila no tempo, desde o começo da rodada
+        self.area_fila = 0.0
+        self.tempo_mudanca_fila = tempo_agora
 
-        return (
-            self.tap_global.precisao_suficiente() and
-            self.tam_global.precisao_suficiente() and
-            self.ncm_global.precisao_suficiente() and
-            self.vazao_global.precisao_suficiente()
-        )
+        # Um intervalo ocupado em andamento passa a contar a partir do
+        # começo da rodada
+        self.tempo_ocupado = 0.0
+        self.comeco_ocupado = tempo_agora
 
-    def finalizar_rodada(self, tempo_rodada):
+    def registrar_tamanho_fila(self, tempo_agora):
+        """Acumula a área sob o tamanho da fila até 'tempo_agora'. Deve
+        ser chamado antes de cada alteração na fila."""
+
+        self.area_fila += len(self.fila) * (tempo_agora - self.tempo_mudanca_fila)
+        self.tempo_mudanca_fila = tempo_agora
+
+    def tempo_ocupado_ate(self, tempo_agora):
+        """Retorna o tempo em que o host viu o Ethernet ocupado desde o
+        começo da rodada até 'tempo_agora', incluindo o intervalo ocupado
+        em andamento."""
+
+        if self.enviando or self.uso_do_meio > 0:
+            return self.tempo_ocupado + (tempo_agora - self.comeco_ocupado)
+        return self.tempo_ocupado
+
+    def finalizar_rodada(self, tempo_rodada, tempo_agora):
         """Salva as estatísticas da rodada na estatística global."""
 
-        self.tap_global.adicionar_amostra(self.tap_rodada.media())
+        self.registrar_tamanho_fila(tempo_agora)
+
+        self.tap_quantis.finalizar_rodada()
+        self.tam_quantis.finalizar_rodada()
+
+        if self.mensagens_chegadas > 0:
+            descarte = 1.0 * self.mensagens_descartadas_rodada / self.mensagens_chegadas
+        else:
+            descarte = 0.0
+        if self.quadros_com_sucesso + self.quadros_perdidos > 0:
+            perdidos = 1.0 * self.quadros_perdidos / (self.quadros_com_sucesso + self.quadros_perdidos)
+        else:
+            perdidos = 0.0
+
+        self.registrar_rodada(
+            self.tap_rodada.media(),
+            self.tam_rodada.media(),
+            self.ncm_rodada.media(),
+            1000000.0 * self.quadros_com_sucesso / tempo_rodada,
+            self.area_fila / tempo_rodada,
+            descarte,
+            perdidos,
+            self.tempo_ocupado_ate(tempo_agora) / tempo_rodada
+        )
+
+    def registrar_rodada(self, tap, tam, ncm, vazao, fila, descarte, perdidos, utilizacao):
+        """Adiciona as médias de uma rodada às estatísticas globais."""
+
+        self.tap_global.adicionar_amostra(tap)
         self.tap_global_media.adicionar_amostra(self.tap_global.media())
         self.tap_global_media.adicionar_intervalo(self.tap_global.intervalo_de_confianca())
 
-        self.tam_global.adicionar_amostra(self.tam_rodada.media())
+        self.tam_global.adicionar_amostra(tam)
         self.tam_global_media.adicionar_amostra(self.tam_global.media())
         self.tam_global_media.adicionar_intervalo(self.tam_global.intervalo_de_confianca())
 
-        self.ncm_global.adicionar_amostra(self.ncm_rodada.media())
+        self.ncm_global.adicionar_amostra(ncm)
         self.ncm_global_media.adicionar_amostra(self.ncm_global.media())
         self.ncm_global_media.adicionar_intervalo(self.ncm_global.intervalo_de_confianca())
 
-        self.vazao_global.adicionar_amostra(1000000.0 * self.quadros_com_sucesso / tempo_rodada)
+        self.vazao_global.adicionar_amostra(vazao)
         self.vazao_global_media.adicionar_amostra(self.vazao_global.media())
         self.vazao_global_media.adicionar_intervalo(self.vazao_global.intervalo_de_confianca())
 
+        self.fila_global.adicionar_amostra(fila)
+        self.fila_global_media.adicionar_amostra(self.fila_global.media())
+        self.fila_global_media.adicionar_intervalo(self.fila_global.intervalo_de_confianca())
+
+        self.descarte_global.adicionar_amostra(descarte)
+        self.descarte_global_media.adicionar_amostra(self.descarte_global.media())
+        self.descarte_global_media.adicionar_intervalo(self.descarte_global.intervalo_de_confianca())
+
+        self.perdidos_global.adicionar_amostra(perdidos)
+        self.perdidos_global_media.adicionar_amostra(self.perdidos_global.media())
+        self.perdidos_global_media.adicionar_intervalo(self.perdidos_global.intervalo_de_confianca())
+
+        self.utilizacao_global.adicionar_amostra(utilizacao)
+        self.utilizacao_global_media.adicionar_amostra(self.utilizacao_global.media())
+        self.utilizacao_global_media.adicionar_intervalo(self.utilizacao_global.intervalo_de_confianca())
+
     def tentar_enviar(self, simulador):
-        debug_print("tentar_enviar maquina=%s tentativas=%d tco=%f" % (self.hostname, self.tentativas_de_transmissao, self.tempo_comeco_ocioso))
+        if DEBUG:
+            debug_print("tentar_enviar maquina=%s tentativas=%d tco=%f" % (self.hostname, self.tentativas_de_transmissao, self.tempo_comeco_ocioso))
 
         if len(self.fila) == 0: return # Nada a transmitir
         if self.enviando: return
@@ -277,7 +1235,7 @@ class Host(object):
             # Binary backoff
             k = self.tentativas_de_transmissao
             if k > 10: k = 10
-            tempo_atraso = random.randint(0, (2 ** k) - 1) * simulador.tempo_fatia_backoff
+            tempo_atraso = self.backoff.sortear(k) * simulador.tempo_fatia_backoff
             if simulador.ignorar_backoff:
                 tempo_atraso = 0
 
@@ -289,7 +1247,8 @@ class Host(object):
                 if self.proximo_quadro == 0:
                     self.tempo_considerar_envio_mensagem = tempo_envio
 
-            debug_print("              agendei para t=%f" % (tempo_envio))
+            if DEBUG:
+                debug_print("              agendei para t=%f" % (tempo_envio))
 
             simulador.eventos.adicionar(
                 tempo_envio,
@@ -307,26 +1266,29 @@ class Host(object):
         self.proximo_quadro += 1
 
         # Se é o último quadro desta mensagem
-        if self.proximo_quadro == self.fila[0].num_quadros:
+        rodada, num_quadros = self.fila[0]
+        if self.proximo_quadro == num_quadros:
             #estatisticas
-            if self.fila[0].rodada == simulador.rodada_atual:
-                self.ncm_rodada.adicionar_amostra(1.0 * self.contador_colisoes / self.fila[0].num_quadros)
+            if rodada == simulador.rodada_atual:
+                self.ncm_rodada.adicionar_amostra(1.0 * self.contador_colisoes / num_quadros)
 
             self.contador_colisoes = 0
 
             #mensagem enviada por completo; retira da fila
             self.proximo_quadro = 0
-            self.fila.pop(0)
+            self.registrar_tamanho_fila(simulador.tempo_agora)
+            self.fila.popleft()
 
 
     def checar_jam(self, simulador):
         if not simulador.ignorar_colisao and self.uso_do_meio != 0 and self.enviando and not self.fim_de_envio.cancelado: #colisao
-            debug_print("  *** COLISAO DETECTADA ***")
+            if DEBUG:
+                debug_print("  *** COLISAO DETECTADA ***")
 
             self.contador_colisoes += 1
 
             #cancelar FimDeEnvio do quadro
-            self.fim_de_envio.cancelado = True
+            simulador.eventos.cancelar(self.fim_de_envio)
 
             #agendar FimDeEnvio do Jam
             simulador.eventos.adicionar(
@@ -337,28 +1299,68 @@ class Host(object):
             #verificar quantidade de tentativas de transmissao
             if self.tentativas_de_transmissao == 16:
                 #descartar quadro
+                self.quadros_descartados += 1
+                # Coleta estatisticas (se rodada valida), como os quadros
+                # com sucesso em FimDeEnvio
+                if self.fim_de_envio.rodada == simulador.rodada_atual:
+                    self.quadros_perdidos += 1
+                self.tentativas_de_transmissao = 0
                 self.andar_fila(simulador)
-                #simulador.perdidos += 1
-                #simulador.totais += 1
 
             #tentará enviar o quadro novamente no FimDeEnvio do jam
 
+    def sincronizar(self, simulador, estrito=False):
+        """Usado no modo de difusão analítica. Aplica as bordas de
+        portadora que chegaram a este host até o tempo atual, exatamente
+        como InicioDeRecebimento e FimDeRecebimento fariam.
+
+        As bordas anteriores ao tempo atual só ficam pendentes enquanto o
+        host não está transmitindo nem esperando o meio ficar livre. Nesse
+        caso checar_jam() e tentar_enviar() não fazem nada, e basta
+        atualizar o uso do meio, o começo do tempo ocioso e o tempo
+        ocupado, cada um no tempo da própria borda.
+
+        Se 'estrito' for verdadeiro, aplica apenas as bordas anteriores ao
+        tempo atual (ver Simulador.sincronizar_hosts)."""
+
+        bordas = self.bordas
+        while bordas and bordas[0][0] <= simulador.tempo_agora:
+            if estrito and bordas[0][0] == simulador.tempo_agora:
+                break
+            tempo, delta, maquina_origem = bordas.popleft()
+            if delta > 0:
+                if self is not maquina_origem:
+                    self.uso_do_meio += 1
+                    if self.uso_do_meio == 1 and not self.enviando:
+                        self.comeco_ocupado = tempo
+                    self.checar_jam(simulador)
+            else:
+                if self is not maquina_origem:
+                    self.uso_do_meio -= 1
+                    if self.uso_do_meio == 0:
+                        self.tempo_comeco_ocioso = tempo
+                        if not self.enviando:
+                            self.tempo_ocupado += tempo - self.comeco_ocupado
+                self.tentar_enviar(simulador)
+
     def __getstate__(self):
-        """Este método é chamado pelo módulo pickle. Este método remove
-        as closures e funções lambda, permitindo que o pickle consiga
-        salvar este objeto.
+        """Este método é chamado pelo módulo pickle. As distribuições
+        (subclasses de Distribuicao) são salvas junto com o estado dos
+        seus geradores, de forma que a simulação pode continuar a partir
+        de um host carregado através do pickle. Outras funções usadas
+        como distribuição (closures e funções lambda) não podem ser
+        salvas e são removidas.
 
         Pickle é um módulo que permite salvar um objeto em um arquivo e
         carregá-lo novamente mais tarde. Neste simulador, é útil para
         poder estudar os dados coletados sem precisar reiniciar a
-        simulação.
-
-        Note que não será possível recomeçar a simulação a partir de um
-        host carregado através do pickle."""
+        simulação, e para continuar uma simulação interrompida (ver
+        Simulador.salvar_checkpoint)."""
 
         d = self.__dict__.copy()
-        d["chegada"] = None
-        d["num_quadros"] = None
+        for campo in ("chegada", "num_quadros"):
+            if not isinstance(d[campo], Distribuicao):
+                d[campo] = None
         return d
 
 
@@ -367,6 +1369,12 @@ class Hub(object):
 
     def __init__(self):
         self.hostname = "Hub"
+        self.indice = -1
+
+    def __reduce__(self):
+        # O pickle salva apenas uma referência a simulador.HUB, pois os
+        # eventos comparam a máquina com "is HUB"
+        return "HUB"
 
 
 # valor especial que representa o hub no campo "maquina" dos eventos
@@ -377,7 +1385,24 @@ HUB = Hub()
 # Eventos
 
 class Evento(object):
-    """Classe abstrata que representa um evento."""
+    """Classe abstrata que representa um evento.
+
+    Como são criados milhões de eventos, todas as classes de eventos usam
+    __slots__ (sem um __dict__ por objeto). Cada classe tem também um
+    código inteiro, TIPO, que a identifica (ver TIPOS_DE_EVENTO).
+
+    Eventos cancelados são descartados pela fila de eventos sem serem
+    processados (ver FilaDeEventos.cancelar). O campo 'cancelado' não
+    pode ter um valor padrão na classe por causa dos __slots__, então é
+    inicializado no construtor de cada evento.
+
+    Os eventos não ficam em arrays do NumPy porque o loop principal trata
+    um evento de cada vez, e ler um registro custa mais que ler um objeto
+    com __slots__; a forma compacta deles existe só no trace."""
+
+    __slots__ = ("cancelado", "maquina")
+
+    TIPO = None
 
     def processar(self, simulador):
         raise NotImplementedError()
@@ -386,14 +1411,20 @@ class Evento(object):
 class ChegouMensagem(Evento):
     """Representa a chegada de uma mensagem da camada superior."""
 
+    __slots__ = ("rodada", "num_quadros")
+
+    TIPO = 0
+
     def __init__(self, rodada, maquina):
+        self.cancelado = False
         self.rodada = rodada
         self.maquina = maquina
         self.num_quadros = maquina.num_quadros()
 
     def processar(self, simulador):
-        debug_print("- Evento: ChegouMensagem com %d quadros em t=%f na maquina=%s" % (
-            self.num_quadros, simulador.tempo_agora, self.maquina.hostname ))
+        if DEBUG:
+            debug_print("- Evento: ChegouMensagem com %d quadros em t=%f na maquina=%s" % (
+                self.num_quadros, simulador.tempo_agora, self.maquina.hostname ))
 
         # Gera o próximo evento
         simulador.eventos.adicionar(
@@ -401,12 +1432,20 @@ class ChegouMensagem(Evento):
             ChegouMensagem(simulador.rodada_atual, self.maquina)
         )
 
-        fila_vazia = (len(self.maquina.fila) == 0)
+        fila = self.maquina.fila
+        fila_vazia = (len(fila) == 0)
+        self.maquina.mensagens_chegadas += 1
+
+        # Fila cheia: a mensagem é descartada
+        if self.maquina.capacidade_fila is not None \
+        and len(fila) >= self.maquina.capacidade_fila:
+            self.maquina.mensagens_descartadas += 1
+            self.maquina.mensagens_descartadas_rodada += 1
+            return
 
         # Adiciona mensagem à fila de envio
-        self.maquina.fila.append(
-            Mensagem(self.rodada, self.num_quadros)
-        )
+        self.maquina.registrar_tamanho_fila(simulador.tempo_agora)
+        fila.append((self.rodada, self.num_quadros))
 
         # A fila estava vazia quando esta mensagem chegou?
         if fila_vazia:
@@ -417,19 +1456,25 @@ class InicioDeEnvio(Evento):
     """Representa o momento em que uma estação começa a transmitir um
     quadro."""
 
+    __slots__ = ()
+
+    TIPO = 1
+
     def __init__(self, maquina):
+        self.cancelado = False
         self.maquina = maquina
 
     def processar(self, simulador):
-        debug_print("- Evento: InicioDeEnvio em t=%f maquina=%s quadro=%d" % (
-            simulador.tempo_agora, self.maquina.hostname, self.maquina.proximo_quadro ))
+        if DEBUG:
+            debug_print("- Evento: InicioDeEnvio em t=%f maquina=%s quadro=%d" % (
+                simulador.tempo_agora, self.maquina.hostname, self.maquina.proximo_quadro ))
 
         #verifica mensagem na fila de envio
         #(ela só será removida de fato no FimDeEnvio com sucesso)
-        mensagem = self.maquina.fila[0]
+        rodada = self.maquina.fila[0][0]
 
         #gera evento de FimDeEnvio e o salva
-        fim_de_envio = FimDeEnvio(mensagem.rodada, self.maquina)
+        fim_de_envio = FimDeEnvio(rodada, self.maquina)
         simulador.eventos.adicionar(
             simulador.tempo_agora + simulador.tempo_transmissao_quadro,
             fim_de_envio
@@ -439,12 +1484,14 @@ class InicioDeEnvio(Evento):
         #gera evento de InicioDeRecebimento no hub
         simulador.eventos.adicionar(
             simulador.tempo_agora + (self.maquina.distancia * simulador.tempo_propagacao),
-            InicioDeRecebimento(mensagem.rodada, HUB, self.maquina)
+            InicioDeRecebimento(rodada, HUB, self.maquina)
         )
 
         #atualiza estado da máquina
         self.maquina.tentativas_de_transmissao += 1
         self.maquina.tempo_comeco_envio_quadro = simulador.tempo_agora
+        if self.maquina.uso_do_meio == 0:
+            self.maquina.comeco_ocupado = simulador.tempo_agora
         self.maquina.enviando = True
         self.maquina.agendado = False
 
@@ -455,26 +1502,29 @@ class FimDeEnvio(Evento):
     """Representa o momento em que um quadro ou reforço de jam terminou
     de ser enviado."""
 
+    __slots__ = ("rodada", "sou_jam")
+
+    TIPO = 2
+
     def __init__(self, rodada, maquina, sou_jam = False):
+        self.cancelado = False
         self.rodada = rodada
         self.maquina = maquina
-        self.cancelado = False
         self.sou_jam = sou_jam
 
     def processar(self, simulador):
-        if self.cancelado: return
-
-        if self.sou_jam:
-            debug_print("- Evento: FimDeEnvio (Jam) em t=%f na maquina=%s" % (
-                simulador.tempo_agora, self.maquina.hostname ))
-        else:
-            debug_print("- Evento: FimDeEnvio (Quadro) em t=%f na maquina=%s" % (
-                simulador.tempo_agora, self.maquina.hostname ))
+        if DEBUG:
+            if self.sou_jam:
+                debug_print("- Evento: FimDeEnvio (Jam) em t=%f na maquina=%s" % (
+                    simulador.tempo_agora, self.maquina.hostname ))
+            else:
+                debug_print("- Evento: FimDeEnvio (Quadro) em t=%f na maquina=%s" % (
+                    simulador.tempo_agora, self.maquina.hostname ))
 
         #gera evento de FimDeRecebimento no hub
         simulador.eventos.adicionar(
             simulador.tempo_agora + (self.maquina.distancia * simulador.tempo_propagacao),
-            FimDeRecebimento(self.rodada, HUB, self.maquina)
+            FimDeRecebimento(self.rodada, HUB, self.maquina, self.sou_jam)
         )
 
         if not self.sou_jam:
@@ -482,11 +1532,15 @@ class FimDeEnvio(Evento):
 
             # Coleta estatisticas (se rodada valida)
             if self.rodada == simulador.rodada_atual:
-                self.maquina.tap_rodada.adicionar_amostra(self.maquina.tempo_comeco_envio_quadro - self.maquina.tempo_considerar_envio_quadro)
+                tap = self.maquina.tempo_comeco_envio_quadro - self.maquina.tempo_considerar_envio_quadro
+                self.maquina.tap_rodada.adicionar_amostra(tap)
+                self.maquina.tap_quantis.adicionar_amostra(tap)
 
                 # Se é o último quadro desta mensagem
-                if self.maquina.proximo_quadro+1 == self.maquina.fila[0].num_quadros:
-                    self.maquina.tam_rodada.adicionar_amostra(self.maquina.tempo_comeco_envio_quadro - self.maquina.tempo_considerar_envio_mensagem)
+                if self.maquina.proximo_quadro+1 == self.maquina.fila[0][1]:
+                    tam = self.maquina.tempo_comeco_envio_quadro - self.maquina.tempo_considerar_envio_mensagem
+                    self.maquina.tam_rodada.adicionar_amostra(tam)
+                    self.maquina.tam_quantis.adicionar_amostra(tam)
 
                 self.maquina.quadros_com_sucesso += 1
 
@@ -501,6 +1555,8 @@ class FimDeEnvio(Evento):
 
         #tentar enviar próximo quadro (agendar para daqui a 9.6us)
         self.maquina.enviando = False
+        if self.maquina.uso_do_meio == 0:
+            self.maquina.tempo_ocupado += simulador.tempo_agora - self.maquina.comeco_ocupado
         self.maquina.tempo_comeco_ocioso = simulador.tempo_agora
         self.maquina.tentar_enviar(simulador)
 
@@ -509,16 +1565,33 @@ class InicioDeRecebimento(Evento):
     """Representa o momento em que uma máquina começa a receber um
     quadro."""
 
+    __slots__ = ("rodada", "maquina_origem")
+
+    TIPO = 3
+
     def __init__(self, rodada, maquina, maquina_origem):
+        self.cancelado = False
         self.rodada = rodada
         self.maquina = maquina
         self.maquina_origem = maquina_origem
 
     def processar(self, simulador):
-        debug_print("- Evento: InicioDeRecebimento em t=%f na maquina=%s, origem=%s" % (
-            simulador.tempo_agora, self.maquina.hostname, self.maquina_origem.hostname ))
+        if DEBUG:
+            debug_print("- Evento: InicioDeRecebimento em t=%f na maquina=%s, origem=%s" % (
+                simulador.tempo_agora, self.maquina.hostname, self.maquina_origem.hostname ))
 
         if self.maquina is HUB:
+            simulador.transmissoes_no_hub += 1
+            if simulador.transmissoes_no_hub == 1:
+                simulador.comeco_ocupado_hub = simulador.tempo_agora
+                simulador.comeco_quadro_hub = simulador.tempo_agora
+            else:
+                simulador.comeco_quadro_hub = None
+
+            if simulador.difusao_analitica:
+                simulador.difundir(1, self.maquina_origem)
+                return
+
             for maquina in simulador.hosts:
                 #gera evento de InicioDeRecebimento nas maquinas
                 simulador.eventos.adicionar(
@@ -528,47 +1601,393 @@ class InicioDeRecebimento(Evento):
         else:
             if self.maquina != self.maquina_origem:
                 self.maquina.uso_do_meio += 1
+                if self.maquina.uso_do_meio == 1 and not self.maquina.enviando:
+                    self.maquina.comeco_ocupado = simulador.tempo_agora
                 self.maquina.checar_jam(simulador)
 
-            debug_print("            uso do meio agora = %d" % self.maquina.uso_do_meio)
+            if DEBUG:
+                debug_print("            uso do meio agora = %d" % self.maquina.uso_do_meio)
 
 
 class FimDeRecebimento(Evento):
     """Representa o momento em que uma máquina termina de receber um
-    quadro."""
+    quadro ou reforço de jam."""
 
-    def __init__(self, rodada, maquina, maquina_origem):
+    __slots__ = ("rodada", "maquina_origem", "sou_jam")
+
+    TIPO = 4
+
+    def __init__(self, rodada, maquina, maquina_origem, sou_jam = False):
+        self.cancelado = False
         self.rodada = rodada
         self.maquina = maquina
         self.maquina_origem = maquina_origem
+        self.sou_jam = sou_jam
 
     def processar(self, simulador):
-        debug_print("- Evento: FimDeRecebimento em t=%f na maquina=%s, origem = %s" % (
-            simulador.tempo_agora, self.maquina.hostname, self.maquina_origem.hostname ))
+        if DEBUG:
+            debug_print("- Evento: FimDeRecebimento em t=%f na maquina=%s, origem = %s" % (
+                simulador.tempo_agora, self.maquina.hostname, self.maquina_origem.hostname ))
 
         if self.maquina is HUB:
+            simulador.transmissoes_no_hub -= 1
+            if simulador.transmissoes_no_hub == 0:
+                simulador.tempo_ocupado_hub += simulador.tempo_agora - simulador.comeco_ocupado_hub
+            if not self.sou_jam:
+                # Quadro que passou inteiro pelo hub (sem colisão); só
+                # conta a parte transmitida dentro desta rodada
+                simulador.tempo_util_hub += min(
+                    simulador.tempo_transmissao_quadro,
+                    simulador.tempo_agora - simulador.tempo_comeco_rodada)
+
+            if simulador.difusao_analitica:
+                simulador.difundir(-1, self.maquina_origem)
+                return
+
             for maquina in simulador.hosts:
                 #gera evento de FimDeRecebimento nas maquinas
                 simulador.eventos.adicionar(
                     simulador.tempo_agora + (maquina.distancia * simulador.tempo_propagacao),
-                    FimDeRecebimento(self.rodada, maquina, self.maquina_origem)
+                    FimDeRecebimento(self.rodada, maquina, self.maquina_origem, self.sou_jam)
                 )
         else:
             if self.maquina != self.maquina_origem:
                 self.maquina.uso_do_meio -= 1
                 if self.maquina.uso_do_meio == 0:
                     self.maquina.tempo_comeco_ocioso = simulador.tempo_agora
+                    if not self.maquina.enviando:
+                        self.maquina.tempo_ocupado += simulador.tempo_agora - self.maquina.comeco_ocupado
 
-            debug_print("            uso do meio agora = %d" % self.maquina.uso_do_meio)
+            if DEBUG:
+                debug_print("            uso do meio agora = %d" % self.maquina.uso_do_meio)
 
             self.maquina.tentar_enviar(simulador)
 
 
+class DespertarHost(Evento):
+    """Usado no modo de difusão analítica. Acorda um host no tempo da
+    sua próxima borda de portadora pendente. As bordas em si são
+    aplicadas por Host.sincronizar(), chamado pelo loop principal antes
+    de processar qualquer evento de um host.
+
+    Não conta no número de eventos das rodadas (ver
+    Simulador.executar_bloco_analitico)."""
+
+    __slots__ = ()
+
+    TIPO = 5
+
+    def __init__(self, maquina):
+        self.cancelado = False
+        self.maquina = maquina
+
+    def processar(self, simulador):
+        if DEBUG:
+            debug_print("- Evento: DespertarHost em t=%f na maquina=%s" % (
+                simulador.tempo_agora, self.maquina.hostname ))
+
+        self.maquina.despertar_agendado = False
+
+
+# Classes de eventos, indexadas pelo código TIPO
+TIPOS_DE_EVENTO = (
+    ChegouMensagem,
+    InicioDeEnvio,
+    FimDeEnvio,
+    InicioDeRecebimento,
+    FimDeRecebimento,
+    DespertarHost,
+)
+
+
+######################################################################
+# Trace binário dos eventos
+
+# Um arquivo de trace começa com a linha MAGICO_TRACE, seguida de uma
+# linha com um objeto JSON (parâmetros do cenário, ver
+# Simulador.abrir_trace) e dos registros de tamanho fixo, um por evento
+# processado, em little-endian e sem alinhamento (ver DTYPE_TRACE).
+#
+# Cada registro guarda, além do evento, o que aconteceu com a mensagem
+# à frente da fila do host ao processá-lo, de forma que TAp, TAm, NCm,
+# vazão e utilização podem ser recalculados a partir do trace (ver
+# ler_trace.py) sem repetir a simulação.
+MAGICO_TRACE = "TRACE-ETHERNET 2\n"
+_ESTRUTURA_TRACE = struct.Struct("<dBBhhiiiidd")
+DTYPE_TRACE = numpy.dtype([
+    ("tempo", "<f8"),
+    # TIPO do evento
+    ("tipo", "u1"),
+    # Combinação das MARCA_* abaixo
+    ("marcas", "u1"),
+    # Índice do host do evento (-1 para o hub)
+    ("host", "<i2"),
+    # Índice da máquina de origem de InicioDeRecebimento e
+    # FimDeRecebimento (-1 para os outros eventos)
+    ("origem", "<i2"),
+    # Rodada em que o evento foi processado
+    ("rodada", "<i4"),
+    # Rodada e número de quadros da mensagem que chegou (ChegouMensagem)
+    # ou da mensagem à frente da fila do host (-1 e 0 se não houver)
+    ("rodada_mensagem", "<i4"),
+    ("quadros", "<i4"),
+    # Colisões sofridas pela mensagem, nos eventos com MARCA_FIM_DE_MENSAGEM
+    ("colisoes", "<i4"),
+    # Amostras de TAp e TAm, nos eventos com MARCA_SUCESSO (TAm somente
+    # com MARCA_FIM_DE_MENSAGEM)
+    ("acesso_quadro", "<f8"),
+    ("acesso_mensagem", "<f8"),
+])
+
+# A mensagem chegou com a fila cheia e foi descartada (ChegouMensagem)
+MARCA_DESCARTADA = 1
+# Fim do reforço de jam (FimDeEnvio)
+MARCA_JAM = 2
+# Quadro transmitido com sucesso (FimDeEnvio)
+MARCA_SUCESSO = 4
+# O host detectou uma colisão
+MARCA_COLISAO = 8
+# Quadro descartado após 16 tentativas de transmissão
+MARCA_PERDIDO = 16
+# O último quadro da mensagem foi transmitido ou descartado, e a
+# mensagem saiu da fila
+MARCA_FIM_DE_MENSAGEM = 32
+
+
+class GravadorDeTrace(object):
+    """Grava o trace binário dos eventos processados pelo simulador. Os
+    registros são acumulados na memória e gravados em blocos."""
+
+    REGISTROS_POR_BLOCO = 4096
+
+    def __init__(self, arquivo, metadados=None, posicao=None):
+        """Cria o arquivo com os 'metadados' ou, se 'posicao' for dada,
+        continua um trace existente a partir dessa posição (descartando
+        o que foi gravado depois dela)."""
+
+        self.arquivo = arquivo
+        self.pendentes = []
+        if posicao is None:
+            self.f = file(arquivo, "wb")
+            self.f.write(MAGICO_TRACE)
+            self.f.write(json.dumps(metadados) + "\n")
+        else:
+            self.f = file(arquivo, "r+b")
+            self.f.seek(posicao)
+            self.f.truncate()
+
+    @staticmethod
+    def estado(evento):
+        """Retorna o estado do host do 'evento' que é comparado por
+        gravar() com o estado após o processamento do evento (None para
+        os eventos do hub, que não alteram os hosts)."""
+
+        maquina = evento.maquina
+        if maquina is HUB:
+            return None
+
+        atrasos = None
+        if evento.TIPO == FimDeEnvio.TIPO and not evento.sou_jam:
+            # tentar_enviar() já terá começado o próximo quadro depois
+            # do processamento
+            atraso_mensagem = 0.0
+            if maquina.proximo_quadro + 1 == maquina.fila[0][1]:
+                atraso_mensagem = maquina.tempo_comeco_envio_quadro - maquina.tempo_considerar_envio_mensagem
+            atrasos = (
+                maquina.tempo_comeco_envio_quadro - maquina.tempo_considerar_envio_quadro,
+                atraso_mensagem,
+            )
+        return (
+            maquina.fila[0] if maquina.fila else None,
+            maquina.proximo_quadro,
+            maquina.contador_colisoes,
+            maquina.quadros_descartados,
+            maquina.mensagens_descartadas,
+            atrasos,
+        )
+
+    def gravar(self, tempo, evento, rodada, estado):
+        """Grava o registro de um evento já processado. 'estado' é o
+        valor retornado por estado() antes do processamento."""
+
+        tipo = evento.TIPO
+        maquina = evento.maquina
+        marcas = 0
+        origem = -1
+        rodada_mensagem = -1
+        quadros = 0
+        colisoes = 0
+        acesso_quadro = 0.0
+        acesso_mensagem = 0.0
+
+        if tipo == InicioDeRecebimento.TIPO or tipo == FimDeRecebimento.TIPO:
+            origem = evento.maquina_origem.indice
+
+        if estado is not None:
+            mensagem, proximo_quadro, colisoes_antes, perdidos_antes, descartadas_antes, atrasos = estado
+
+            if tipo == ChegouMensagem.TIPO:
+                rodada_mensagem = evento.rodada
+                quadros = evento.num_quadros
+                if maquina.mensagens_descartadas > descartadas_antes:
+                    marcas |= MARCA_DESCARTADA
+            elif mensagem is not None:
+                rodada_mensagem, quadros = mensagem
+
+                # Um quadro descartado também conta como colisão (o
+                # contador da mensagem é zerado quando ela sai da fila)
+                if maquina.quadros_descartados > perdidos_antes:
+                    marcas |= MARCA_PERDIDO | MARCA_COLISAO
+                elif maquina.contador_colisoes > colisoes_antes:
+                    marcas |= MARCA_COLISAO
+
+                if atrasos is not None:
+                    marcas |= MARCA_SUCESSO
+                    acesso_quadro = atrasos[0]
+
+                if marcas & (MARCA_SUCESSO | MARCA_PERDIDO) and proximo_quadro + 1 == quadros:
+                    marcas |= MARCA_FIM_DE_MENSAGEM
+                    colisoes = colisoes_antes + (1 if marcas & MARCA_COLISAO else 0)
+                    if atrasos is not None:
+                        acesso_mensagem = atrasos[1]
+
+            if tipo == FimDeEnvio.TIPO and evento.sou_jam:
+                marcas |= MARCA_JAM
+
+        self.pendentes.append(_ESTRUTURA_TRACE.pack(
+            tempo, tipo, marcas, maquina.indice, origem, rodada,
+            rodada_mensagem, quadros, colisoes, acesso_quadro, acesso_mensagem))
+        if len(self.pendentes) >= self.REGISTROS_POR_BLOCO:
+            self.descarregar()
+
+    def descarregar(self):
+        """Grava os registros pendentes. Retorna a posição do final do
+        arquivo."""
+
+        self.f.write("".join(self.pendentes))
+        self.pendentes = []
+        self.f.flush()
+        return self.f.tell()
+
+    def fechar(self):
+        self.descarregar()
+        self.f.close()
+
+
+def ler_trace(arquivo):
+    """Lê um arquivo gravado por GravadorDeTrace. Retorna (metadados,
+    registros), onde 'registros' é um array do NumPy com o DTYPE_TRACE
+    mapeado diretamente do arquivo (sem carregá-lo todo na memória)."""
+
+    f = file(arquivo, "rb")
+    try:
+        if f.readline() != MAGICO_TRACE:
+            raise ValueError("'%s' não é um arquivo de trace" % arquivo)
+        metadados = json.loads(f.readline())
+        inicio = f.tell()
+        f.seek(0, os.SEEK_END)
+        num_registros = (f.tell() - inicio) // DTYPE_TRACE.itemsize
+    finally:
+        f.close()
+
+    if num_registros == 0:
+        return metadados, numpy.zeros(0, dtype=DTYPE_TRACE)
+    return metadados, numpy.memmap(arquivo, dtype=DTYPE_TRACE, mode="r",
+                                   offset=inicio, shape=(num_registros,))
+
+
+######################################################################
+# Critério de parada do número de rodadas "automático"
+
+class CriterioDeParada(object):
+    """Define quais estatísticas precisam atingir qual precisão para que
+    a simulação possa terminar."""
+
+    METRICAS = ("tap", "tam", "ncm", "vazao", "utilizacao")
+
+    def __init__(self,
+            metricas=METRICAS,
+            hosts=None,
+            precisao_relativa=0.10,
+            precisao_absoluta=None,
+            confianca=None
+        ):
+        """Recebe os parâmetros do critério:
+        metricas = Métricas que precisam atingir a precisão: "tap", "tam",
+            "ncm" e "vazao" (de cada host) e "utilizacao" (do Ethernet)
+        hosts = Nomes dos hosts considerados (None para todos os ativos)
+        precisao_relativa = Largura máxima do intervalo de confiança, como
+            fração da média
+        precisao_absoluta = Largura máxima do intervalo de confiança, na
+            unidade da métrica
+        confianca = Nível de confiança dos intervalos (None para usar o
+            nível de confiança do simulador)
+
+        As precisões podem ser um número, None (não usada) ou um
+        dicionário com a precisão de cada métrica. Basta que uma das duas
+        precisões seja atingida."""
+
+        for metrica in metricas:
+            if metrica not in self.METRICAS:
+                raise ValueError("Métrica desconhecida: '%s'" % metrica)
+
+        self.metricas = metricas
+        self.hosts = hosts
+        self.precisao_relativa = precisao_relativa
+        self.precisao_absoluta = precisao_absoluta
+        self.confianca = confianca
+
+    def _precisao(self, precisao, metrica):
+        if isinstance(precisao, dict):
+            return precisao.get(metrica)
+        return precisao
+
+    def precisao_suficiente(self, estatistica, metrica):
+        return estatistica.precisao_suficiente(
+            self._precisao(self.precisao_relativa, metrica),
+            self._precisao(self.precisao_absoluta, metrica),
+            self.confianca
+        )
+
+    def satisfeito(self, simulador):
+        """Indica se as estatísticas do simulador já possuem a precisão
+        desejada."""
+
+        for metrica in self.metricas:
+            if metrica == "utilizacao":
+                if not self.precisao_suficiente(simulador.utilizacao_global, metrica):
+                    return False
+                continue
+
+            for host in simulador.hosts:
+                if not host.ativo:
+                    continue
+                if self.hosts is not None and host.hostname not in self.hosts:
+                    continue
+                if not self.precisao_suficiente(getattr(host, metrica + "_global"), metrica):
+                    return False
+
+        return True
+
+
 ######################################################################
 
 class Simulador(object):
     """Classe principal que encapsula um simulador."""
 
+    # Número de eventos de cada observação da detecção da fase transiente
+    BLOCO_TRANSIENTE = 1000
+
+    # Número de eventos entre duas amostras de utilizacao_total
+    EVENTOS_POR_AMOSTRA_UTILIZACAO = 1000
+
+    # Número mínimo de rodadas para estimar a autocorrelação entre elas
+    MIN_RODADAS_AUTOCORRELACAO = 10
+
+    # Parâmetros que não alteram o resultado da simulação
+    PARAMETROS_FORA_DO_CACHE = ("verboso", "arquivo_checkpoint", "rodadas_por_checkpoint",
+                                "arquivo_perfil", "arquivo_trace")
+
     def __init__(self,
             hosts,
             eventos_fase_transiente=50000,
@@ -581,7 +2000,21 @@ class Simulador(object):
             tempo_fatia_backoff=51.2,
             numero_de_rodadas=-1,  # Número de rodadas da simulação (-1 para automático)
             ignorar_backoff = False,  # Apenas para cenários de teste
-            ignorar_colisao = False   # Apenas para cenários de teste
+            ignorar_colisao = False,  # Apenas para cenários de teste
+            verboso = True,  # Imprime o relatório de cada rodada
+            nivel_de_confianca = 0.95,  # Nível de confiança dos intervalos
+            criterio_de_parada = None,  # CriterioDeParada (None para o padrão)
+            detectar_transiente = False,  # Termina a fase transiente pelo MSER-5 (eventos_fase_transiente vira o máximo)
+            lote_adaptativo = False,  # Dobra eventos_por_rodada enquanto as médias das rodadas forem correlacionadas
+            limite_autocorrelacao = 0.1,  # Piso da autocorrelação lag-1 aceita entre as médias das rodadas (ver verificar_autocorrelacao)
+            escalonador = "heap",  # Implementação da fila de eventos (ver ESCALONADORES)
+            difusao_analitica = False,  # Não gera um evento por host em cada difusão do hub
+            semente = None,  # Semente dos geradores aleatórios (None para não reiniciá-los)
+            arquivo_checkpoint = None,  # Arquivo onde o estado da simulação é salvo periodicamente
+            rodadas_por_checkpoint = 10,  # Intervalo, em rodadas, entre os checkpoints
+            arquivo_perfil = None,  # Arquivo onde é acrescentado o perfil de desempenho de cada rodada
+            arquivo_trace = None,  # Arquivo onde é gravado o trace binário dos eventos (ver GravadorDeTrace)
+            percentis = (50, 95, 99)  # Percentis de TAp e TAm estimados em cada host (ver Quantis)
         ):
         """Recebe todos os parâmetros da simulação."""
         self.hosts = hosts
@@ -597,36 +2030,176 @@ class Simulador(object):
         self.numero_de_rodadas = numero_de_rodadas
         self.ignorar_backoff = ignorar_backoff
         self.ignorar_colisao = ignorar_colisao
+        self.verboso = verboso
+        self.nivel_de_confianca = nivel_de_confianca
+        if criterio_de_parada is None:
+            criterio_de_parada = CriterioDeParada()
+        self.criterio_de_parada = criterio_de_parada
+        self.detectar_transiente = detectar_transiente
+        self.lote_adaptativo = lote_adaptativo
+        self.limite_autocorrelacao = limite_autocorrelacao
+
+        if escalonador not in ESCALONADORES:
+            raise ValueError("Escalonador desconhecido: '%s'" % escalonador)
+        self.escalonador = escalonador
+        self.difusao_analitica = difusao_analitica
+        self.semente = semente
+        self.arquivo_checkpoint = arquivo_checkpoint
+        self.rodadas_por_checkpoint = rodadas_por_checkpoint
+        self.arquivo_perfil = arquivo_perfil
+        self.arquivo_trace = arquivo_trace
+        self.gravador_trace = None
+        self.posicao_trace = None
+        self.percentis = percentis
+
+    def semear(self, semente):
+        """Reinicia os geradores aleatórios de todos os hosts a partir de
+        'semente'. Cada host recebe sequências próprias, derivadas da
+        semente e do seu hostname (e não da sua posição na lista), e cada
+        distribuição do host usa uma sequência separada.
+
+        Assim, dois cenários que diferem apenas em um host, ou apenas em
+        uma distribuição de um host, usam os mesmos números aleatórios em
+        todo o resto (números aleatórios comuns), o que reduz a variância
+        da diferença entre eles."""
+
+        for host in self.hosts:
+            host.semear([semente, zlib.crc32(host.hostname) & 0xffffffff])
 
     def start(self):
         """Prepara o simulador, inicializando algumas variáveis e
         gerando os eventos iniciais"""
 
-        self.utilizacao_global = Estatisticas()
-        self.utilizacao_global_media = Estatisticas()
-
-        self.utilizacao_total = Estatisticas()
-        self.tempo_ocupado_total = 0
-
-        self.eventos = HeapDeEventos()
+        # Utilização do Ethernet vista pelo primeiro host
+        self.utilizacao_global = Estatisticas(confianca=self.nivel_de_confianca)
+        self.utilizacao_global_media = Estatisticas(confianca=self.nivel_de_confianca)
+
+        # Utilização vista pelo hub: total, a parte ocupada por quadros
+        # transmitidos com sucesso e a parte perdida em colisões
+        self.utilizacao_hub_global = Estatisticas(confianca=self.nivel_de_confianca)
+        self.utilizacao_util_global = Estatisticas(confianca=self.nivel_de_confianca)
+        self.colisao_global = Estatisticas(confianca=self.nivel_de_confianca)
+
+        # Amostrada a cada EVENTOS_POR_AMOSTRA_UTILIZACAO eventos durante
+        # toda a simulação; para o gráfico basta guardar algumas amostras
+        self.utilizacao_total = Estatisticas(max_amostras=2000)
+        # Tempo ocupado visto pelo primeiro host nas rodadas já encerradas
+        self.tempo_ocupado_total = 0.0
+
+        # Transmissões passando pelo hub, começo do intervalo ocupado
+        # atual e tempos ocupado e útil do hub desde o começo da rodada
+        self.transmissoes_no_hub = 0
+        self.comeco_ocupado_hub = 0.0
+        # Começo do quadro que passa sozinho pelo hub (None depois que
+        # outro quadro se sobrepõe a ele)
+        self.comeco_quadro_hub = None
+        self.tempo_ocupado_hub = 0.0
+        self.tempo_util_hub = 0.0
+
+        self.eventos = ESCALONADORES[self.escalonador]()
         self.tempo_agora = 0
+        # Eventos executados além do pedido no último executar_eventos(),
+        # descontados do próximo (ver executar_bloco_analitico)
+        self.eventos_excedentes = 0
+        self.rodada_atual = 0
+        self.autocorrelacao_lag1 = None
+        self.limite_autocorrelacao_aplicado = None
+
+        # Tamanho da fase transiente, atualizado por executar_fase_transiente()
+        # quando o MSER-5 está ligado. O simulador que apenas junta as
+        # replicações (ver execucao.rodar_replicacoes) nunca chega a executar run()
+        self.eventos_rodada_zero = self.eventos_fase_transiente
+        self.truncamento_transiente = None
+
+        if self.semente is not None:
+            self.semear(self.semente)
+
+        # Código inteiro de cada host (o hub é -1), usado quando os
+        # eventos são registrados de forma compacta
+        for indice, host in enumerate(self.hosts):
+            host.indice = indice
+
+        if self.gravador_trace is not None:
+            self.gravador_trace.fechar()
+            self.gravador_trace = None
+        self.posicao_trace = None
+        if self.arquivo_trace is not None:
+            self.abrir_trace()
 
         for host in self.hosts:
-            host.reset()
+            host.reset(self.nivel_de_confianca, self.percentis)
             if host.ativo:
                 self.eventos.adicionar(
                     host.chegada(),
                     ChegouMensagem(0, host)
                 )
 
-    def run(self):
+    def difundir(self, delta, maquina_origem):
+        """Usado no modo de difusão analítica. Em vez de agendar um
+        InicioDeRecebimento ou FimDeRecebimento para cada host, anota a
+        borda de portadora (delta = +1 ligando, -1 desligando) na lista
+        de bordas pendentes de cada host, com o tempo de chegada calculado
+        a partir da distância do host ao hub."""
+
+        for host in self.hosts:
+            host.bordas.append((
+                self.tempo_agora + (host.distancia * self.tempo_propagacao),
+                delta,
+                maquina_origem
+            ))
+            self.agendar_despertar(host)
+
+    def agendar_despertar(self, host):
+        """Usado no modo de difusão analítica. Agenda um DespertarHost na
+        próxima borda pendente do host, caso ele precise reagir a ela:
+        quando está transmitindo (para detectar colisões) ou esperando o
+        meio ficar livre. As bordas dos outros hosts são aplicadas mais
+        tarde, no próximo evento do host ou no fim da rodada (ver
+        sincronizar_hosts)."""
+
+        if host.bordas and not host.despertar_agendado and (
+            host.enviando or
+            (host.fila and not host.agendado)
+        ):
+            self.eventos.adicionar(host.bordas[0][0], DespertarHost(host))
+            host.despertar_agendado = True
+
+    def sincronizar_hosts(self, hosts=None):
+        """Usado no modo de difusão analítica. Aplica as bordas de
+        portadora anteriores ao tempo atual que ainda estão pendentes em
+        'hosts' (por padrão, todos), para que o tempo ocupado visto por
+        eles esteja atualizado. As bordas no próprio tempo atual ficam
+        para os eventos desse instante que ainda estão na fila."""
+
+        if not self.difusao_analitica:
+            return
+        for host in hosts or self.hosts:
+            host.sincronizar(self, estrito=True)
+
+    def ocupado_total(self):
+        """Retorna o tempo total, desde o começo da simulação, em que o
+        primeiro host viu o Ethernet ocupado."""
+
+        self.sincronizar_hosts(self.hosts[:1])
+        return self.tempo_ocupado_total + self.hosts[0].tempo_ocupado_ate(self.tempo_agora)
+
+    def run(self, ate_rodada=None):
         """Executa o loop principal do simulador até conseguir coletar
         as estatísticas com a precisão desejada, e então desenha alguns
-        gráficos."""
+        gráficos. Se 'ate_rodada' for dado, para também ao terminar essa
+        rodada (com ate_rodada=0, executa apenas a fase transiente).
+
+        Também pode ser chamado em um simulador carregado com
+        carregar_checkpoint() ou criado por bifurcar(), continuando a
+        partir da rodada seguinte."""
+
+        # Continuando a partir de um checkpoint (ver __getstate__)
+        if self.arquivo_trace is not None and self.gravador_trace is None:
+            self.abrir_trace()
 
         # Neste simulador, a rodada zero é considerada a fase transiente
-        print "Fase transiente..."
-        self.rodada_atual = 0
+        if self.verboso and self.rodada_atual == 0:
+            print "Fase transiente..."
 
         wallclock_comeco_simulacao = time.time()
 
@@ -640,86 +2213,581 @@ class Simulador(object):
                 # - não estou na fase transiente
                 # - e todos os hosts chegaram à precisão desejada
                 # - e a utilização do Ethernet chegou à precisão desejada
-                if self.rodada_atual > 0 \
-                and all(
-                    host.precisao_suficiente()
-                    for host in self.hosts if host.ativo
-                ) and self.utilizacao_global_media.precisao_suficiente():
+                if self.rodada_atual > 0 and self.precisao_suficiente():
                     break
             # Número de rodadas "fixo"
             else:
                 if self.rodada_atual > self.numero_de_rodadas:
                     break
+            if ate_rodada is not None and self.rodada_atual > ate_rodada:
+                break
 
             # Wallclock é relógio de parede, e armazena o tempo
             # decorrido no "mundo real"
             wallclock_comeco_rodada = time.time()
 
             # Reiniciando estatísticas para a próxima rodada
+            self.tempo_ocupado_total += self.hosts[0].tempo_ocupado_ate(self.tempo_agora)
             for host in self.hosts:
-                host.reiniciar_estatisticas()
-
-            self.tempo_ocupado_rodada = 0
-            self.tempo_comeco_rodada = self.tempo_agora
-            self.tempo_evento_anterior = self.tempo_agora
+                host.reiniciar_estatisticas(self.tempo_agora)
 
-            # Quantos eventos devem ser simulados nesta rodada?
-            if self.rodada_atual == 0:
-                eventos_nesta_rodada = self.eventos_fase_transiente
-            else:
-                eventos_nesta_rodada = self.eventos_por_rodada
-
-            # Executa os eventos dentro de uma rodada
-            for iteracao in xrange(eventos_nesta_rodada):
-                # Retirar evento da fila
-                self.tempo_agora, evento = self.eventos.remover()
+            self.tempo_ocupado_hub = 0.0
+            self.tempo_util_hub = 0.0
+            self.comeco_ocupado_hub = self.tempo_agora
 
-                # Atualizar estatistica de utilização
-                # (coletada apenas para a primeira máquina)
-                if self.hosts[0].enviando or self.hosts[0].uso_do_meio > 0:
-                    self.tempo_ocupado_rodada += self.tempo_agora - self.tempo_evento_anterior
-                    self.tempo_ocupado_total += self.tempo_agora - self.tempo_evento_anterior
+            if self.arquivo_perfil is not None:
+                self.iniciar_perfil()
 
-                self.tempo_evento_anterior = self.tempo_agora
+            self.tempo_comeco_rodada = self.tempo_agora
 
-                # Processar evento
-                evento.processar(self)
+            # Executa os eventos dentro de uma rodada
+            if self.rodada_atual > 0:
+                self.executar_eventos(self.eventos_por_rodada)
+            elif self.detectar_transiente:
+                self.executar_fase_transiente()
+            else:
+                self.executar_eventos(self.eventos_fase_transiente)
+                self.eventos_rodada_zero = self.eventos_fase_transiente
 
-                # Coletar utilização ethernet (de vez em quando)
-                if iteracao % 1000 == 0:
-                    self.utilizacao_total.adicionar_amostra(self.tempo_ocupado_total / self.tempo_agora)
+            # Fechando os intervalos ocupados no fim da rodada
+            self.sincronizar_hosts()
 
             # Coletar e exibir estatísticas
             if self.rodada_atual > 0:
                 tempo_duracao_da_rodada = self.tempo_agora - self.tempo_comeco_rodada
 
                 # Coletando estatísticas...
-                self.utilizacao_global.adicionar_amostra(self.tempo_ocupado_rodada / tempo_duracao_da_rodada)
-                self.utilizacao_global_media.adicionar_amostra(self.utilizacao_global.media())
-                self.utilizacao_global_media.adicionar_intervalo(self.utilizacao_global.intervalo_de_confianca())
+                self.registrar_utilizacao(self.hosts[0].tempo_ocupado_ate(self.tempo_agora) / tempo_duracao_da_rodada)
+
+                tempo_ocupado_hub = self.tempo_ocupado_hub
+                if self.transmissoes_no_hub > 0:
+                    tempo_ocupado_hub += self.tempo_agora - self.comeco_ocupado_hub
+                # O quadro que passa sozinho pelo hub também é cortado no
+                # fim da rodada, e o resto dele é contado na próxima, em
+                # FimDeRecebimento. A parte desta rodada conta como útil sem
+                # que se saiba se o quadro ainda vai colidir: como o
+                # InicioDeEnvio marcado pelo backoff não verifica o meio de
+                # novo, outra estação ainda pode transmitir por cima dele.
+                tempo_util_hub = self.tempo_util_hub
+                if self.transmissoes_no_hub == 1 and self.comeco_quadro_hub is not None:
+                    tempo_util_hub += self.tempo_agora - max(self.comeco_quadro_hub, self.tempo_comeco_rodada)
+                self.registrar_utilizacao_hub(
+                    tempo_ocupado_hub / tempo_duracao_da_rodada,
+                    tempo_util_hub / tempo_duracao_da_rodada,
+                    (tempo_ocupado_hub - tempo_util_hub) / tempo_duracao_da_rodada
+                )
 
                 # Coletando estatísticas...
                 for host in self.hosts:
-                    host.finalizar_rodada(tempo_duracao_da_rodada)
+                    host.finalizar_rodada(tempo_duracao_da_rodada, self.tempo_agora)
+
+                self.verificar_autocorrelacao()
 
                 # Calculando o tempo real gasto na simulação
                 wallclock_fim_rodada = time.time()
                 wallclock_duracao_rodada = wallclock_fim_rodada - wallclock_comeco_rodada
                 wallclock_duracao_simulacao = wallclock_fim_rodada - wallclock_comeco_simulacao
 
-                print "Rodada %d" % (self.rodada_atual,)
-                print "-Tempo real: %.2f segundos nesta rodada, %.2f no total" % (wallclock_duracao_rodada, wallclock_duracao_simulacao)
-                print "-Tempo simulado: %.2f microseg nesta rodada, %.2f total" % (tempo_duracao_da_rodada, self.tempo_agora)
-                print "-Media uso Ether  =%13f | IC +-%13f | %12f na rodada" % (self.utilizacao_global.media(), self.utilizacao_global.intervalo_de_confianca(), self.utilizacao_global.amostras[-1])
-                for i, host in enumerate(self.hosts):
-                    if host.ativo:
-                        print "-Media do TAp(%d)  =%13f | IC +-%13f | %12f na rodada" % (i+1, host.tap_global.media(),   host.tap_global.intervalo_de_confianca(),   host.tap_rodada.media())
-                        print "-Media do TAm(%d)  =%13f | IC +-%13f | %12f na rodada" % (i+1, host.tam_global.media(),   host.tam_global.intervalo_de_confianca(),   host.tam_rodada.media())
-                        print "-Media do Ncm(%d)  =%13f | IC +-%13f | %12f na rodada" % (i+1, host.ncm_global.media(),   host.ncm_global.intervalo_de_confianca(),   host.ncm_rodada.media())
-                        print "-Media da Vazao(%d)=%13f | IC +-%13f | %12f na rodada" % (i+1, host.vazao_global.media(), host.vazao_global.intervalo_de_confianca(), host.vazao_global.amostras[-1])
+                if self.verboso:
+                    print "Rodada %d" % (self.rodada_atual,)
+                    print "-Tempo real: %.2f segundos nesta rodada, %.2f no total" % (wallclock_duracao_rodada, wallclock_duracao_simulacao)
+                    print "-Tempo simulado: %.2f microseg nesta rodada, %.2f total" % (tempo_duracao_da_rodada, self.tempo_agora)
+                    self.imprimir_relatorio()
+
+            if self.arquivo_perfil is not None:
+                self.gravar_perfil()
+            if self.gravador_trace is not None:
+                self.gravador_trace.descarregar()
+
+            self.rodada_atual += 1
+
+            if self.arquivo_checkpoint is not None \
+            and (self.rodada_atual - 1) % self.rodadas_por_checkpoint == 0:
+                self.salvar_checkpoint(self.arquivo_checkpoint)
+
+    def abrir_trace(self):
+        """Cria o arquivo_trace ou, se ele já foi gravado até a
+        posicao_trace por este simulador, continua a partir dela."""
+
+        if self.posicao_trace is None:
+            # Os parâmetros necessários para recalcular as estatísticas
+            # a partir do trace
+            self.gravador_trace = GravadorDeTrace(self.arquivo_trace, {
+                "titulo": self.titulo,
+                "hosts": [host.hostname for host in self.hosts],
+                "ativos": [host.ativo for host in self.hosts],
+                "distancias": [host.distancia for host in self.hosts],
+                "tempo_propagacao": self.tempo_propagacao,
+                "nivel_de_confianca": self.nivel_de_confianca,
+            })
+        else:
+            self.gravador_trace = GravadorDeTrace(self.arquivo_trace, posicao=self.posicao_trace)
+
+    def __getstate__(self):
+        """Este método é chamado pelo módulo pickle. O arquivo aberto do
+        trace não pode ser salvo; guarda-se apenas até onde ele já foi
+        gravado, para que run() possa continuá-lo ao retomar a simulação
+        a partir de um checkpoint."""
+
+        d = self.__dict__.copy()
+        if self.gravador_trace is not None:
+            d["posicao_trace"] = self.gravador_trace.descarregar()
+            d["gravador_trace"] = None
+        return d
+
+    def salvar_checkpoint(self, arquivo):
+        """Salva todo o estado da simulação (fila de eventos, hosts,
+        estado dos geradores aleatórios e estatísticas) em 'arquivo'.
+
+        Um checkpoint anterior nunca fica corrompido se a simulação for
+        interrompida no meio da gravação (ver gravar_pickle)."""
+
+        gravar_pickle(self, arquivo)
+
+        if self.verboso:
+            print "-Checkpoint salvo em %s (rodada %d)" % (arquivo, self.rodada_atual - 1)
+
+    def bifurcar(self, semente):
+        """Retorna uma cópia independente do simulador, no mesmo estado
+        (normalmente logo após a fase transiente, com run(ate_rodada=0)),
+        mas com os geradores aleatórios reiniciados com 'semente'. Chamando
+        run() na cópia, a simulação continua sem repetir a fase transiente.
+
+        Todas as cópias partem do mesmo estado inicial; apenas os números
+        aleatórios sorteados daí em diante são diferentes."""
+
+        copia = pickle.loads(pickle.dumps(self, protocol=2))
+        copia.semente = semente
+        copia.semear(semente)
+        # A cópia não continua o trace do simulador original
+        copia.arquivo_trace = None
+        return copia
+
+    def chave_de_cache(self, *extras):
+        """Retorna a chave deste cenário no cache de resultados: um hash
+        de todos os parâmetros do simulador e dos hosts (incluindo a
+        semente), da versão do simulador e de 'extras' (outras opções que
+        mudam o resultado, como o uso de replicações).
+
+        Deve ser chamado antes de start(), pois algumas opções (como o
+        lote adaptativo) alteram os parâmetros durante a simulação."""
+
+        parametros = dict(
+            (nome, getattr(self, nome))
+            for nome in inspect.getargspec(Simulador.__init__)[0][1:]
+            if nome not in self.PARAMETROS_FORA_DO_CACHE
+        )
+        descricao = "%s %s %s" % (VERSAO_SIMULADOR, _descrever(parametros), _descrever(extras))
+        return hashlib.md5(descricao).hexdigest()
+
+    def estatisticas_por_rodada(self):
+        """Retorna as estatísticas globais que recebem uma amostra (a média
+        de um lote) por rodada, cada uma num par (estatística, série das
+        suas médias acumuladas ou None)."""
+
+        estatisticas = [
+            (self.utilizacao_global, self.utilizacao_global_media),
+            (self.utilizacao_hub_global, None),
+            (self.utilizacao_util_global, None),
+            (self.colisao_global, None),
+        ]
+        for host in self.hosts:
+            for nome in ("tap", "tam", "ncm", "vazao", "fila", "descarte", "perdidos", "utilizacao"):
+                estatisticas.append((getattr(host, nome + "_global"), getattr(host, nome + "_global_media")))
+        return estatisticas
+
+    def juntar_lotes(self):
+        """Agrupa dois a dois os lotes já coletados em todas as séries
+        por rodada: as médias dos lotes, as séries das médias acumuladas
+        (com os seus intervalos de confiança, recalculados com os lotes
+        maiores) e as estimativas dos percentis. Assim nenhum intervalo
+        mistura lotes de tamanhos diferentes."""
+
+        for estatistica, medias in self.estatisticas_por_rodada():
+            estatistica.juntar_pares()
+            if medias is not None:
+                medias.refazer_medias(estatistica)
+        for host in self.hosts:
+            host.tap_quantis.juntar_pares()
+            host.tam_quantis.juntar_pares()
+
+    def verificar_autocorrelacao(self):
+        """Calcula a autocorrelação lag-1 das médias das rodadas (a maior
+        entre a utilização e o TAp de cada host ativo). No modo de lote
+        adaptativo, se ela passar do limite, os lotes já coletados são
+        agrupados dois a dois e as próximas rodadas passam a ter o dobro
+        de eventos.
+
+        Com poucos lotes, a autocorrelação estimada de lotes independentes
+        varia bastante. Por isso o limite aplicado é o maior entre
+        limite_autocorrelacao e 2/sqrt(n), o limite de Bartlett para n
+        lotes independentes: limite_autocorrelacao é apenas um piso, e só
+        decide com 400 lotes ou mais (com o padrão 0.1). O limite aplicado
+        fica em limite_autocorrelacao_aplicado e aparece no relatório."""
+
+        self.autocorrelacao_lag1 = max(
+            [self.utilizacao_global.autocorrelacao()] +
+            [host.tap_global.autocorrelacao() for host in self.hosts if host.ativo]
+        )
+
+        num_lotes = self.utilizacao_global.num_amostras
+        self.limite_autocorrelacao_aplicado = max(self.limite_autocorrelacao, 2.0 / math.sqrt(max(num_lotes, 1)))
+        if self.lote_adaptativo \
+        and num_lotes >= self.MIN_RODADAS_AUTOCORRELACAO and num_lotes % 2 == 0 \
+        and self.autocorrelacao_lag1 > self.limite_autocorrelacao_aplicado:
+            if self.verboso:
+                print "-Autocorrelação lag-1 = %f (limite %f); agrupando os lotes dois a dois" % (
+                    self.autocorrelacao_lag1, self.limite_autocorrelacao_aplicado)
+
+            self.juntar_lotes()
+            self.eventos_por_rodada *= 2
+
+    def executar_eventos(self, num_eventos):
+        """Executa os próximos 'num_eventos' eventos da fila, em blocos de
+        EVENTOS_POR_AMOSTRA_UTILIZACAO eventos. A utilização acumulada do
+        Ethernet é amostrada no fim de cada bloco.
+
+        Cada executar_bloco*() retorna quantos eventos executou; o que
+        passar de 'num_eventos' é descontado da próxima chamada."""
+
+        if self.arquivo_perfil is not None or self.gravador_trace is not None:
+            executar_bloco = self.executar_bloco_instrumentado
+        elif self.difusao_analitica:
+            executar_bloco = self.executar_bloco_analitico
+        else:
+            executar_bloco = self.executar_bloco
+
+        num_eventos -= self.eventos_excedentes
+        while num_eventos > 0:
+            bloco = min(num_eventos, self.EVENTOS_POR_AMOSTRA_UTILIZACAO)
+            num_eventos -= executar_bloco(bloco)
+
+            # Coletar utilização ethernet (de vez em quando)
+            if self.tempo_agora > 0:
+                self.utilizacao_total.adicionar_amostra(self.ocupado_total() / self.tempo_agora)
+        self.eventos_excedentes = -num_eventos
+
+    def executar_bloco(self, num_eventos):
+        """Loop principal: executa os próximos 'num_eventos' eventos da
+        fila."""
+
+        for iteracao in xrange(num_eventos):
+            # Retirar evento da fila
+            self.tempo_agora, evento = self.eventos.remover()
+
+            # Processar evento
+            evento.processar(self)
+
+        return num_eventos
+
+    def executar_bloco_analitico(self, num_eventos):
+        """Loop principal do modo de difusão analítica.
+
+        Para que as rodadas terminem nos mesmos pontos que no modo
+        normal, os eventos são contados como se cada difusão do hub
+        gerasse um evento em cada host: um evento do hub conta como
+        1 + len(hosts) eventos, e os DespertarHost não contam. Assim, as
+        estatísticas de cada rodada podem ser comparadas com as do modo
+        normal. A única diferença é que os eventos de uma difusão são
+        contados juntos, no tempo em que o hub a faz, e não quando a
+        borda chega a cada host. Por isso uma rodada pode terminar até
+        um tempo de propagação (menos de um microssegundo nos cenários)
+        antes do que no modo normal.
+
+        Retorna o número de eventos contados."""
+
+        por_difusao = 1 + len(self.hosts)
+        despertar = DespertarHost.TIPO
+
+        contados = 0
+        while contados < num_eventos:
+            # Retirar evento da fila
+            self.tempo_agora, evento = self.eventos.remover()
+
+            # Processar evento
+            maquina = evento.maquina
+            if maquina is HUB:
+                evento.processar(self)
+                contados += por_difusao
+            else:
+                maquina.sincronizar(self)
+                evento.processar(self)
+                self.agendar_despertar(maquina)
+                if evento.TIPO != despertar:
+                    contados += 1
+
+        return contados
+
+    def executar_bloco_instrumentado(self, num_eventos):
+        """Versão instrumentada de executar_bloco(), usada quando o
+        arquivo_perfil ou o arquivo_trace são definidos. Além de executar
+        os eventos, mede o tempo gasto pela fila de eventos e pelo
+        processamento de cada tipo de evento e o tamanho da fila, e grava
+        o trace. É um loop separado para que a instrumentação não deixe
+        o loop normal mais lento.
+
+        No modo de difusão analítica, os eventos são contados como em
+        executar_bloco_analitico(). Retorna o número de eventos contados."""
+
+        perfil = None
+        if self.arquivo_perfil is not None:
+            perfil = self.perfil
+            contagem = perfil["contagem"]
+            segundos = perfil["segundos"]
+        trace = self.gravador_trace
+        relogio = time.time
+
+        analitica = self.difusao_analitica
+        por_evento_do_hub = 1 + len(self.hosts) if analitica else 1
+        despertar = DespertarHost.TIPO
+
+        contados = 0
+        while contados < num_eventos:
+            # Retirar evento da fila
+            if perfil is not None:
+                comeco = relogio()
+            self.tempo_agora, evento = self.eventos.remover()
+            if perfil is not None:
+                meio = relogio()
+            if trace is not None:
+                estado = trace.estado(evento)
+
+            # Processar evento
+            if analitica and evento.maquina is not HUB:
+                evento.maquina.sincronizar(self)
+                evento.processar(self)
+                self.agendar_despertar(evento.maquina)
+                if evento.TIPO != despertar:
+                    contados += 1
+            else:
+                evento.processar(self)
+                contados += por_evento_do_hub if evento.maquina is HUB else 1
+
+            if trace is not None:
+                trace.gravar(self.tempo_agora, evento, self.rodada_atual, estado)
+
+            if perfil is not None:
+                fim = relogio()
+                perfil["segundos_fila"] += meio - comeco
+                contagem[evento.TIPO] += 1
+                segundos[evento.TIPO] += fim - meio
+
+                tamanho = len(self.eventos)
+                perfil["soma_tamanhos"] += tamanho
+                if tamanho > perfil["tamanho_maximo"]:
+                    perfil["tamanho_maximo"] = tamanho
+
+        return contados
+
+    def iniciar_perfil(self):
+        """Reinicia o perfil de desempenho no começo de uma rodada."""
+
+        self.perfil = {
+            "contagem": [0] * len(TIPOS_DE_EVENTO),
+            "segundos": [0.0] * len(TIPOS_DE_EVENTO),
+            "segundos_fila": 0.0,
+            "soma_tamanhos": 0,
+            "tamanho_maximo": 0,
+            "descartados": self.eventos.descartados,
+            "wallclock": time.time(),
+        }
+
+    def gravar_perfil(self):
+        """Acrescenta o perfil de desempenho da rodada ao arquivo_perfil,
+        como um objeto JSON em uma linha."""
+
+        perfil = self.perfil
+        duracao = time.time() - perfil["wallclock"]
+        eventos = sum(perfil["contagem"])
+        # Lápides (eventos cancelados) retiradas da fila nesta rodada
+        descartados = self.eventos.descartados - perfil["descartados"]
+
+        registro = {
+            "versao": VERSAO_SIMULADOR,
+            "titulo": self.titulo,
+            "data": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "escalonador": self.escalonador,
+            "difusao_analitica": self.difusao_analitica,
+            "num_hosts": len(self.hosts),
+            "rodada": self.rodada_atual,
+            "eventos": eventos,
+            "segundos": duracao,
+            "eventos_por_segundo": eventos / duracao if duracao > 0 else None,
+            "segundos_fila": perfil["segundos_fila"],
+            "tamanho_fila_maximo": perfil["tamanho_maximo"],
+            "tamanho_fila_medio": 1.0 * perfil["soma_tamanhos"] / eventos if eventos else 0.0,
+            "cancelados_descartados": descartados,
+            "fracao_cancelados": 1.0 * descartados / (eventos + descartados) if eventos + descartados else 0.0,
+            "lapides_na_fila": self.eventos.cancelados,
+            "tipos": dict(
+                (tipo.__name__, {
+                    "eventos": perfil["contagem"][tipo.TIPO],
+                    "segundos": perfil["segundos"][tipo.TIPO],
+                })
+                for tipo in TIPOS_DE_EVENTO
+            ),
+        }
+
+        f = file(self.arquivo_perfil, "a")
+        try:
+            f.write(json.dumps(registro, sort_keys=True) + "\n")
+        finally:
+            f.close()
+
+        if self.verboso:
+            print "-Perfil: %d eventos/s | fila de eventos: %d no máximo, %.1f em média | %.1f%% cancelados" % (
+                registro["eventos_por_segundo"] or 0, registro["tamanho_fila_maximo"],
+                registro["tamanho_fila_medio"], 100 * registro["fracao_cancelados"])
+
+    def executar_fase_transiente(self):
+        """Executa a rodada zero até que o método MSER-5 indique que a
+        simulação chegou ao estado estacionário, ou até executar
+        'eventos_fase_transiente' eventos.
+
+        Os eventos são executados em blocos de BLOCO_TRANSIENTE eventos.
+        Para cada bloco são observadas a utilização do Ethernet e a média
+        do TAp de cada host ativo. A fase transiente termina quando o
+        ponto de truncamento do MSER-5 de todas essas séries está na
+        primeira metade dos dados observados."""
+
+        hosts = [host for host in self.hosts if host.ativo]
+        serie_utilizacao = []
+        series_tap = [[] for host in hosts]
+
+        self.truncamento_transiente = None
+        eventos = 0
+        while eventos < self.eventos_fase_transiente:
+            tempo_comeco_bloco = self.tempo_agora
+            tempo_ocupado_comeco_bloco = self.ocupado_total()
+            taps_comeco_bloco = [(host.tap_rodada.num_amostras, host.tap_rodada.media()) for host in hosts]
+
+            bloco = min(self.BLOCO_TRANSIENTE, self.eventos_fase_transiente - eventos)
+            self.executar_eventos(bloco)
+            eventos += bloco
+
+            if self.tempo_agora > tempo_comeco_bloco:
+                serie_utilizacao.append(
+                    (self.ocupado_total() - tempo_ocupado_comeco_bloco) /
+                    (self.tempo_agora - tempo_comeco_bloco))
+            for host, serie, (n, media) in zip(hosts, series_tap, taps_comeco_bloco):
+                num_quadros = host.tap_rodada.num_amostras - n
+                if num_quadros > 0:
+                    soma = host.tap_rodada.media() * host.tap_rodada.num_amostras - media * n
+                    serie.append(soma / num_quadros)
+
+            if eventos % (self.BLOCO_TRANSIENTE * 25) != 0:
+                continue
+
+            truncamentos = [truncamento_mser5(serie) for serie in [serie_utilizacao] + series_tap]
+            if None not in truncamentos:
+                # Convertendo de blocos para eventos (aproximadamente, já
+                # que nas séries de TAp os blocos sem quadros não contam)
+                self.truncamento_transiente = max(truncamentos) * self.BLOCO_TRANSIENTE
+                break
+
+        self.eventos_rodada_zero = eventos
+        self.tempo_fim_fase_transiente = self.tempo_agora
+
+        if self.verboso:
+            if self.truncamento_transiente is None:
+                print "-Estado estacionário não detectado em %d eventos" % (eventos,)
+            else:
+                print "-Estado estacionário detectado em %d eventos (truncamento MSER-5 em %d eventos)" % (
+                    eventos, self.truncamento_transiente)
+
+    def precisao_suficiente(self):
+        """Condição de parada do número de rodadas "automático", definida
+        pelo critério de parada (por padrão, todas as métricas de todos os
+        hosts ativos e a utilização do Ethernet)."""
+
+        return self.criterio_de_parada.satisfeito(self)
+
+    def registrar_utilizacao(self, utilizacao):
+        """Adiciona a utilização de uma rodada às estatísticas globais."""
+
+        self.utilizacao_global.adicionar_amostra(utilizacao)
+        self.utilizacao_global_media.adicionar_amostra(self.utilizacao_global.media())
+        self.utilizacao_global_media.adicionar_intervalo(self.utilizacao_global.intervalo_de_confianca())
+
+    def registrar_utilizacao_hub(self, utilizacao, util, colisao):
+        """Adiciona a utilização vista pelo hub em uma rodada (total, útil
+        e em colisões) às estatísticas globais."""
+
+        self.utilizacao_hub_global.adicionar_amostra(utilizacao)
+        self.utilizacao_util_global.adicionar_amostra(util)
+        self.colisao_global.adicionar_amostra(colisao)
+
+    def imprimir_relatorio(self):
+        """Imprime as médias globais, os intervalos de confiança e os
+        valores obtidos na última rodada."""
+
+        if self.autocorrelacao_lag1 is not None:
+            print "-Lotes: %d, com %d eventos por rodada | autocorrelação lag-1 = %f (limite %f)" % (self.utilizacao_global.num_amostras, self.eventos_por_rodada, self.autocorrelacao_lag1, self.limite_autocorrelacao_aplicado)
+        print "-Media uso Ether  =%13f | IC +-%13f | %12f na rodada" % (self.utilizacao_global.media(), self.utilizacao_global.intervalo_de_confianca(), self.utilizacao_global.ultima_amostra)
+        for nome, estatistica in ((u"Uso Ether (hub)", self.utilizacao_hub_global),
+                                  (u"Uso útil (hub)", self.utilizacao_util_global),
+                                  (u"Colisões (hub)", self.colisao_global)):
+            print (u"-%-17s=%13f | IC +-%13f | %12f na rodada" % (nome, estatistica.media(), estatistica.intervalo_de_confianca(), estatistica.ultima_amostra)).encode("utf-8")
+        for i, host in enumerate(self.hosts):
+            if host.ativo:
+                print "-Media do TAp(%d)  =%13f | IC +-%13f | %12f na rodada" % (i+1, host.tap_global.media(),   host.tap_global.intervalo_de_confianca(),   host.tap_global.ultima_amostra)
+                print "-Media do TAm(%d)  =%13f | IC +-%13f | %12f na rodada" % (i+1, host.tam_global.media(),   host.tam_global.intervalo_de_confianca(),   host.tam_global.ultima_amostra)
+                print "-Media do Ncm(%d)  =%13f | IC +-%13f | %12f na rodada" % (i+1, host.ncm_global.media(),   host.ncm_global.intervalo_de_confianca(),   host.ncm_global.ultima_amostra)
+                print "-Media da Vazao(%d)=%13f | IC +-%13f | %12f na rodada" % (i+1, host.vazao_global.media(), host.vazao_global.intervalo_de_confianca(), host.vazao_global.ultima_amostra)
+                print "-Media da Fila(%d) =%13f | IC +-%13f | %12f na rodada" % (i+1, host.fila_global.media(),  host.fila_global.intervalo_de_confianca(),  host.fila_global.ultima_amostra)
+                print "-Msgs descart.(%d) =%13f | IC +-%13f | %12f na rodada" % (i+1, host.descarte_global.media(), host.descarte_global.intervalo_de_confianca(), host.descarte_global.ultima_amostra)
+                print "-Quadros perd.(%d) =%13f | IC +-%13f | %12f na rodada" % (i+1, host.perdidos_global.media(), host.perdidos_global.intervalo_de_confianca(), host.perdidos_global.ultima_amostra)
+                print "-Uso Ether(%d)     =%13f | IC +-%13f | %12f na rodada" % (i+1, host.utilizacao_global.media(), host.utilizacao_global.intervalo_de_confianca(), host.utilizacao_global.ultima_amostra)
+                for nome, quantis in (("TAp", host.tap_quantis), ("TAm", host.tam_quantis)):
+                    for j, p in enumerate(quantis.percentis):
+                        print "-%-17s=%13f | IC +-%13f | %12f na rodada" % ("%s(%d) p%g" % (nome, i+1, p), quantis.valor(j), quantis.intervalo_de_confianca(j), quantis.lotes[j].ultima_amostra)
+
+    def amostras_das_rodadas(self):
+        """Retorna as médias de todas as rodadas já executadas, num
+        formato compacto que pode ser enviado entre processos:
+        (utilização, [(tap, tam, ncm, vazão, fila, descarte, perdidos,
+        utilização, quantis de TAp, quantis de TAm) de cada host],
+        (utilização, útil, colisões) do hub), onde os quantis estão no
+        formato de Quantis.amostras() e as estatísticas do hub são os
+        próprios objetos Estatisticas"""
+
+        return (
+            self.utilizacao_global.amostras,
+            [
+                (host.tap_global.amostras, host.tam_global.amostras,
+                 host.ncm_global.amostras, host.vazao_global.amostras,
+                 host.fila_global.amostras, host.descarte_global.amostras,
+                 host.perdidos_global.amostras, host.utilizacao_global.amostras,
+                 host.tap_quantis.amostras(), host.tam_quantis.amostras())
+                for host in self.hosts
+            ],
+            (self.utilizacao_hub_global, self.utilizacao_util_global, self.colisao_global)
+        )
+
+    def incorporar_rodadas(self, amostras):
+        """Adiciona às estatísticas globais as médias das rodadas de
+        outra replicação do mesmo cenário, no formato retornado por
+        amostras_das_rodadas()."""
 
+        utilizacao, amostras_hosts, amostras_hub = amostras
+        for valor in utilizacao:
+            self.registrar_utilizacao(valor)
             self.rodada_atual += 1
 
+        # Sem as séries de médias acumuladas, as estatísticas do hub podem
+        # ser combinadas de uma vez
+        for estatistica, outra in zip(
+            (self.utilizacao_hub_global, self.utilizacao_util_global, self.colisao_global),
+            amostras_hub
+        ):
+            estatistica.combinar(outra)
+
+        for host, amostras_host in zip(self.hosts, amostras_hosts):
+            for rodada in zip(*amostras_host[:8]):
+                host.registrar_rodada(*rodada)
+            host.tap_quantis.incorporar(amostras_host[8])
+            host.tam_quantis.incorporar(amostras_host[9])
+
     def exibir_graficos(self):
         """Exibe na tela os gráficos já gerados."""
         pyplot.show()
@@ -735,7 +2803,7 @@ class Simulador(object):
         pyplot.savefig(filename, dpi=dpi)
 
     def gerar_graficos(self, layout="horizontal"):
-        """Gera os 6 gráficos disponíveis, usando layout "horizontal"
+        """Gera os 9 gráficos disponíveis, usando layout "horizontal"
         (para tela) ou "vertical" (para impressão)"""
 
         graficos = [
@@ -749,14 +2817,17 @@ class Simulador(object):
             (5, 4, self.gerar_grafico_vazao),
             (3, 5, self.gerar_grafico_utilizacao),
             (6, 6, self.gerar_grafico_utilizacao_total),
+            (7, 7, self.gerar_grafico_fila),
+            (8, 8, self.gerar_grafico_descarte),
+            (9, 9, self.gerar_grafico_perdidos),
         ]
 
         if layout == "horizontal":
-            rows = 2
+            rows = 3
             cols = 3
             pos_index = 0
         elif layout == "vertical":
-            rows = 3
+            rows = 5
             cols = 2
             pos_index = 1
         else:
@@ -767,9 +2838,9 @@ class Simulador(object):
         pyplot.figure()
 
         # Ajustando o espaço vertical entre os gráficos
-        pyplot.subplots_adjust(hspace=0.25)
+        pyplot.subplots_adjust(hspace=0.6)
 
-        # Desenha os 6 gráficos
+        # Desenha os 9 gráficos
         for grafico in graficos:
             pyplot.subplot(rows, cols, grafico[pos_index])
             grafico[-1]()  # Chama a função (último elemento da tupla)
@@ -820,6 +2891,39 @@ class Simulador(object):
         pyplot.xticks(fontsize="x-small")
         pyplot.yticks(fontsize="x-small")
 
+    def gerar_grafico_fila(self):
+        for host in self.hosts:
+            if host.ativo:
+                host.fila_global_media.plot(label=host.hostname)
+        #exibir_legenda()
+        pyplot.grid(True)
+        pyplot.title(u"Tamanho médio da fila (mensagens)", fontsize="small")
+        pyplot.xlim(0, self.rodada_atual)
+        pyplot.xticks(fontsize="x-small")
+        pyplot.yticks(fontsize="x-small")
+
+    def gerar_grafico_descarte(self):
+        for host in self.hosts:
+            if host.ativo:
+                host.descarte_global_media.plot(label=host.hostname)
+        #exibir_legenda()
+        pyplot.grid(True)
+        pyplot.title(u"Mensagens descartadas (fila cheia)", fontsize="small")
+        pyplot.xlim(0, self.rodada_atual)
+        pyplot.xticks(fontsize="x-small")
+        pyplot.yticks(fontsize="x-small")
+
+    def gerar_grafico_perdidos(self):
+        for host in self.hosts:
+            if host.ativo:
+                host.perdidos_global_media.plot(label=host.hostname)
+        #exibir_legenda()
+        pyplot.grid(True)
+        pyplot.title(u"Quadros descartados (16 tentativas)", fontsize="small")
+        pyplot.xlim(0, self.rodada_atual)
+        pyplot.xticks(fontsize="x-small")
+        pyplot.yticks(fontsize="x-small")
+
     def gerar_grafico_utilizacao(self):
         self.utilizacao_global_media.plot(label=u"média")
         self.utilizacao_global.plot(marker="x", color="#C04040", label=u"amostras")
@@ -835,7 +2939,7 @@ class Simulador(object):
         pyplot.xscale("log")
 
         # Marcando o fim da fase transiente
-        pos_x = self.eventos_fase_transiente/1000.0
+        pos_x = self.eventos_rodada_zero/1000.0
         pyplot.axvline(pos_x, color="red")
         pyplot.annotate(u"Fim da fase transiente", xy=(pos_x, 0.0625),
             rotation="vertical", size="x-small", ha="right", va="bottom")
@@ -851,3 +2955,72 @@ class Simulador(object):
         pyplot.xlabel(u"eventos / 1000", fontsize="small");
         pyplot.xticks(fontsize="x-small")
         pyplot.yticks(fontsize="x-small")
+
+
+def gravar_pickle(objeto, arquivo):
+    """Salva 'objeto' em 'arquivo' usando o pickle. O arquivo é escrito
+    com outro nome e depois renomeado, de forma que nunca fica pela
+    metade se o programa for interrompido no meio da gravação."""
+
+    temporario = arquivo + ".tmp"
+    with open(temporario, "wb") as f:
+        pickle.dump(objeto, f, protocol=2)
+    # No Windows, rename() não substitui um arquivo existente
+    if os.name == "nt" and os.path.exists(arquivo):
+        os.remove(arquivo)
+    os.rename(temporario, arquivo)
+
+
+def carregar_checkpoint(arquivo):
+    """Carrega um simulador salvo por Simulador.salvar_checkpoint(). Para
+    continuar a simulação exatamente de onde parou, basta chamar run()
+    (sem chamar start())."""
+
+    with open(arquivo, "rb") as f:
+        return pickle.load(f)
+
+
+######################################################################
+# Chave do cache de resultados (ver execucao.CacheDeResultados)
+
+def _versao_do_simulador():
+    """Hash do código-fonte deste módulo: qualquer alteração no simulador
+    invalida os resultados guardados no cache."""
+
+    try:
+        with open(os.path.splitext(__file__)[0] + ".py", "rb") as f:
+            return hashlib.md5(f.read()).hexdigest()
+    except IOError:
+        return "desconhecida"
+
+VERSAO_SIMULADOR = _versao_do_simulador()
+
+
+def _descrever(valor):
+    """Retorna uma descrição canônica (uma string) de um parâmetro do
+    simulador, usada na chave do cache. As distribuições são descritas
+    pelos seus parâmetros, sem o estado do gerador, e os hosts pelos
+    parâmetros do construtor."""
+
+    if isinstance(valor, Host):
+        return "Host(%s)" % _descrever(dict(
+            (nome, getattr(valor, nome))
+            for nome in inspect.getargspec(Host.__init__)[0][1:]
+        ))
+    elif isinstance(valor, Distribuicao):
+        return "%s(%s)" % (type(valor).__name__, _descrever(dict(
+            (nome, parametro)
+            for nome, parametro in valor.__dict__.items()
+            if nome not in ("gerador", "bloco")
+        )))
+    elif isinstance(valor, dict):
+        return "{%s}" % ", ".join(
+            "%r: %s" % (nome, _descrever(valor[nome])) for nome in sorted(valor.keys()))
+    elif isinstance(valor, (list, tuple)):
+        return "[%s]" % ", ".join(_descrever(item) for item in valor)
+    elif hasattr(valor, "__dict__") and not callable(valor):
+        return "%s(%s)" % (type(valor).__name__, _descrever(valor.__dict__))
+    else:
+        # Funções (como lambdas) aparecem com o endereço, e portanto um
+        # cenário que as usa nunca é encontrado no cache
+        return repr(valor)
@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vi:ts=4 sw=4 et
+
+"""Varredura de parâmetros: executa um cenário base com vários valores
+dos parâmetros dos hosts e do simulador, em paralelo, e grava uma tabela
+com os resultados de cada ponto (arquivos .csv e .npy).
+
+Os parâmetros são identificados por nomes:
+    maq2.chegada     intervalo médio entre chegadas de mensagens do host
+                     maq2 (mantém o tipo da distribuição; se o host não
+                     gerava tráfego, usa Exponencial)
+    maq2.num_quadros número de quadros por mensagem (como no Host: um
+                     valor menor que 1 é a probabilidade da Geometrica;
+                     os demais são arredondados para um inteiro)
+    maq2.distancia   distância do host ao hub, em metros
+    maq2.capacidade_fila
+                     número máximo de mensagens na fila do host
+    num_hosts        número de hosts (os que faltarem são cópias do
+                     último host do cenário)
+    qualquer outro nome é um atributo do Simulador, como
+    eventos_por_rodada ou numero_de_rodadas
+
+Cada ponto já calculado fica guardado em um cache de resultados (ver
+execucao.CacheDeResultados), com uma chave derivada da definição
+completa do cenário, e não é calculado de novo em uma varredura
+posterior.
+
+Exemplo:
+    python varredura.py 4 maq1.chegada=40000,80000,160000 num_hosts=2,3,4
+"""
+
+import copy
+import csv
+import itertools
+import sys
+import time
+
+import numpy
+
+from execucao import CacheDeResultados, OptionParser, executar_em_paralelo
+import simulador
+
+
+######################################################################
+# Conjuntos de pontos
+
+def grade(valores):
+    """'valores' associa o nome de cada parâmetro a uma lista de valores.
+    Retorna todas as combinações (o produto cartesiano), cada uma como um
+    dicionário que associa o nome de cada parâmetro ao seu valor."""
+
+    nomes = sorted(valores.keys())
+    return [
+        dict(zip(nomes, combinacao))
+        for combinacao in itertools.product(*[valores[nome] for nome in nomes])
+    ]
+
+
+def hipercubo_latino(intervalos, num_pontos, semente=1):
+    """'intervalos' associa o nome de cada parâmetro a (mínimo, máximo).
+    Retorna 'num_pontos' pontos de um hipercubo latino: cada intervalo é
+    dividido em 'num_pontos' faixas de mesma largura, e cada faixa de
+    cada parâmetro recebe exatamente um ponto."""
+
+    gerador = numpy.random.RandomState(semente)
+    nomes = sorted(intervalos.keys())
+    colunas = []
+    for nome in nomes:
+        minimo, maximo = intervalos[nome]
+        faixas = (gerador.permutation(num_pontos) + gerador.random_sample(num_pontos)) / num_pontos
+        colunas.append(minimo + faixas * (maximo - minimo))
+    return [
+        dict((nome, float(coluna[i])) for nome, coluna in zip(nomes, colunas))
+        for i in xrange(num_pontos)
+    ]
+
+
+######################################################################
+# Aplicando os parâmetros de um ponto ao cenário
+
+def ajustar_num_hosts(sim, num_hosts):
+    """Remove os últimos hosts do simulador, ou acrescenta cópias do
+    último host (com novos hostnames), até ficar com 'num_hosts'."""
+
+    hosts = sim.hosts[:num_hosts]
+    hostnames = set(host.hostname for host in sim.hosts)
+    while len(hosts) < num_hosts:
+        novo = copy.deepcopy(sim.hosts[-1])
+        i = len(hosts) + 1
+        while "maq%d" % (i,) in hostnames:
+            i += 1
+        novo.hostname = "maq%d" % (i,)
+        hostnames.add(novo.hostname)
+        hosts.append(novo)
+    sim.hosts = hosts
+
+
+def aplicar_parametros(sim, ponto):
+    """Altera o simulador criado pelo cenário base de acordo com os
+    parâmetros de 'ponto' (ver a documentação do módulo)."""
+
+    if "num_hosts" in ponto:
+        ajustar_num_hosts(sim, int(round(ponto["num_hosts"])))
+
+    for nome, valor in sorted(ponto.items()):
+        if nome == "num_hosts":
+            continue
+
+        if "." in nome:
+            hostname, atributo = nome.split(".", 1)
+            hosts = [host for host in sim.hosts if host.hostname == hostname]
+            if not hosts:
+                raise ValueError("Host desconhecido: '%s'" % hostname)
+            host = hosts[0]
+
+            if atributo == "chegada":
+                if isinstance(host.chegada, simulador.Distribuicao):
+                    host.chegada = type(host.chegada)(valor)
+                else:
+                    host.chegada = simulador.Exponencial(valor)
+            elif atributo == "num_quadros":
+                # Um número de quadros fracionário nunca completaria a
+                # mensagem; abaixo de 1, o valor é a probabilidade da
+                # Geometrica
+                if valor <= 0:
+                    raise ValueError("'%s' deve ser positivo: %s" % (nome, valor))
+                if valor >= 1:
+                    valor = int(round(valor))
+                host.num_quadros = simulador.distribuicao_num_quadros(valor)
+            elif atributo == "distancia":
+                host.distancia = valor
+            elif atributo == "capacidade_fila":
+                host.capacidade_fila = int(round(valor))
+            else:
+                raise ValueError("Parâmetro de host desconhecido: '%s'" % nome)
+            host.ativo = callable(host.chegada) and callable(host.num_quadros)
+
+        elif hasattr(sim, nome):
+            # Os atributos inteiros (número de eventos, de rodadas...)
+            # continuam inteiros com os valores do hipercubo latino
+            if isinstance(getattr(sim, nome), (int, long)) and not isinstance(getattr(sim, nome), bool):
+                valor = int(round(valor))
+            setattr(sim, nome, valor)
+        else:
+            raise ValueError("Parâmetro desconhecido: '%s'" % nome)
+
+
+######################################################################
+# Executando os pontos
+
+def resultados(sim):
+    """Retorna um dicionário com as médias e os intervalos de confiança
+    das estatísticas globais do simulador, uma coluna para cada valor."""
+
+    linha = {
+        "rodadas": sim.rodada_atual - 1,
+        "utilizacao": sim.utilizacao_global.media(),
+        "utilizacao_ic": sim.utilizacao_global.intervalo_de_confianca(),
+    }
+    for nome, estatistica in (
+        ("utilizacao_hub", sim.utilizacao_hub_global),
+        ("utilizacao_util", sim.utilizacao_util_global),
+        ("colisao", sim.colisao_global),
+    ):
+        linha[nome] = estatistica.media()
+        linha["%s_ic" % (nome,)] = estatistica.intervalo_de_confianca()
+    for host in sim.hosts:
+        if not host.ativo:
+            continue
+        for nome, estatistica in (
+            ("tap", host.tap_global),
+            ("tam", host.tam_global),
+            ("ncm", host.ncm_global),
+            ("vazao", host.vazao_global),
+            ("fila", host.fila_global),
+            ("descarte", host.descarte_global),
+            ("perdidos", host.perdidos_global),
+            ("utilizacao", host.utilizacao_global),
+        ):
+            linha["%s.%s" % (host.hostname, nome)] = estatistica.media()
+            linha["%s.%s_ic" % (host.hostname, nome)] = estatistica.intervalo_de_confianca()
+        for nome, quantis in (("tap", host.tap_quantis), ("tam", host.tam_quantis)):
+            for j, p in enumerate(quantis.percentis):
+                linha["%s.%s_p%g" % (host.hostname, nome, p)] = quantis.valor(j)
+                linha["%s.%s_p%g_ic" % (host.hostname, nome, p)] = quantis.intervalo_de_confianca(j)
+    return linha
+
+
+def _executar_ponto(argumentos):
+    """Executa, em um processo do pool, um ponto da varredura."""
+
+    fabrica, ponto, semente = argumentos
+
+    wallclock_comeco = time.time()
+
+    sim = fabrica()
+    aplicar_parametros(sim, ponto)
+    sim.semente = semente
+    sim.verboso = False
+    sim.start()
+    sim.run()
+
+    linha = resultados(sim)
+    linha.update(ponto)
+    linha["semente"] = semente
+    linha["tempo_real"] = time.time() - wallclock_comeco
+    return linha
+
+
+def varrer(fabrica, pontos, processos=None, semente=1, diretorio_cache="varredura_cache", verboso=True):
+    """Executa o cenário criado por 'fabrica' (uma função sem parâmetros,
+    como as funções cenarioN dos scripts rodar_cenario*.py) em cada
+    ponto de 'pontos' (uma lista de dicionários, como os retornados por
+    grade() e hipercubo_latino()), todos com a mesma semente.
+
+    Os pontos são executados em paralelo, em 'processos' processos, e os
+    pontos já guardados no cache em 'diretorio_cache' não são executados
+    de novo. Retorna a lista de resultados, um dicionário por ponto, na
+    ordem de 'pontos'."""
+
+    cache = CacheDeResultados(diretorio_cache)
+
+    linhas = [None] * len(pontos)
+    faltando = []
+    for i, ponto in enumerate(pontos):
+        # A chave vem do cenário já alterado; isso também verifica os
+        # nomes dos parâmetros antes de começar
+        sim = fabrica()
+        aplicar_parametros(sim, ponto)
+        sim.semente = semente
+        chave = sim.chave_de_cache("varredura")
+
+        linha = cache.carregar(chave)
+        if linha is not None:
+            # Outro ponto pode ter gerado o mesmo cenário
+            linha.update(ponto)
+            linhas[i] = linha
+        else:
+            faltando.append((i, chave))
+
+    if verboso:
+        print "%d pontos, %d no cache" % (len(pontos), len(pontos) - len(faltando))
+
+    tarefas = [(fabrica, pontos[i], semente) for i, chave in faltando]
+    for concluidos, linha in enumerate(executar_em_paralelo(_executar_ponto, tarefas, processos)):
+        i, chave = faltando[concluidos]
+        linhas[i] = linha
+        cache.guardar(chave, linha)
+
+        if verboso:
+            print "[%d/%d] %s: utilização = %f (%.1f segundos)" % (
+                concluidos + 1, len(faltando),
+                " ".join("%s=%s" % item for item in sorted(pontos[i].items())),
+                linha["utilizacao"], linha["tempo_real"])
+
+    return linhas
+
+
+######################################################################
+# Tabela de resultados
+
+def colunas(linhas, parametros):
+    """Retorna a ordem das colunas da tabela: os parâmetros, depois as
+    colunas gerais e por último as colunas de cada host."""
+
+    gerais = ["semente", "rodadas", "tempo_real", "utilizacao", "utilizacao_ic",
+              "utilizacao_hub", "utilizacao_hub_ic", "utilizacao_util", "utilizacao_util_ic",
+              "colisao", "colisao_ic"]
+    todas = set()
+    for linha in linhas:
+        todas.update(linha.keys())
+    return list(parametros) + gerais + sorted(todas - set(parametros) - set(gerais))
+
+
+def salvar_tabela(linhas, parametros, prefixo):
+    """Grava os resultados em 'prefixo'.csv e em 'prefixo'.npy (um array
+    estruturado do NumPy, com uma coluna float64 por campo). Os valores
+    que não existem em um ponto (por exemplo, de um host inativo) ficam
+    vazios no .csv e NaN no .npy."""
+
+    nomes = colunas(linhas, parametros)
+
+    f = file(prefixo + ".csv", "wb")
+    try:
+        escritor = csv.writer(f)
+        escritor.writerow(nomes)
+        for linha in linhas:
+            escritor.writerow([linha.get(nome, "") for nome in nomes])
+    finally:
+        f.close()
+
+    tabela = numpy.empty(len(linhas), dtype=[(nome, numpy.float64) for nome in nomes])
+    for i, linha in enumerate(linhas):
+        tabela[i] = tuple(linha.get(nome, numpy.nan) for nome in nomes)
+    numpy.save(prefixo + ".npy", tabela)
+    # Depois, é possível recarregar a tabela usando:
+    #   tabela = numpy.load("varredura.npy")
+    #   tabela["maq1.tap"], tabela[tabela["num_hosts"] == 3], ...
+
+
+######################################################################
+# Linha de comando
+
+def _numero(texto):
+    try:
+        return int(texto)
+    except ValueError:
+        return float(texto)
+
+
+def main():
+    parser = OptionParser(usage="%prog [opções] <cenário> <parâmetro>=<valor>,<valor>,... [...]")
+    parser.add_option("-m", "--modulo", default="rodar_cenario",
+        help="módulo que define os cenários (padrão: rodar_cenario)")
+    parser.add_option("-l", "--hipercubo-latino", type="int", default=None, metavar="N",
+        help="em vez da grade, usa N pontos de um hipercubo latino; cada "
+             "parâmetro recebe então <mínimo>,<máximo>")
+    parser.add_option("-p", "--processos", type="int", default=None,
+        help="número de pontos executados ao mesmo tempo (padrão: número de CPUs)")
+    parser.add_option("-s", "--semente", type="int", default=1,
+        help="semente dos geradores aleatórios (padrão: 1)")
+    parser.add_option("-o", "--saida", default="varredura",
+        help="prefixo dos arquivos .csv e .npy gerados (padrão: varredura)")
+    parser.add_option("-d", "--cache", default="varredura_cache",
+        help="diretório com os resultados dos pontos já executados (padrão: varredura_cache)")
+    opcoes, argumentos = parser.parse_args()
+
+    modulo = __import__(opcoes.modulo)
+    if len(argumentos) < 2 or argumentos[0] not in modulo.cenarios:
+        parser.print_help()
+        print
+        print "Cenários disponíveis: " + " ".join(sorted(modulo.cenarios.keys()))
+        sys.exit(1)
+
+    valores = {}
+    for argumento in argumentos[1:]:
+        nome, lista = argumento.split("=", 1)
+        valores[nome] = [_numero(valor) for valor in lista.split(",")]
+    parametros = sorted(valores.keys())
+
+    if opcoes.hipercubo_latino:
+        for nome in parametros:
+            if len(valores[nome]) != 2:
+                parser.error("com -l, '%s' deve receber <mínimo>,<máximo>" % nome)
+        pontos = hipercubo_latino(valores, opcoes.hipercubo_latino, opcoes.semente)
+    else:
+        pontos = grade(valores)
+
+    wallclock_comeco = time.time()
+    linhas = varrer(modulo.cenarios[argumentos[0]], pontos,
+                    processos=opcoes.processos, semente=opcoes.semente,
+                    diretorio_cache=opcoes.cache)
+    salvar_tabela(linhas, parametros, opcoes.saida)
+
+    print "Resultados gravados em %s.csv e %s.npy (%.1f segundos)" % (
+        opcoes.saida, opcoes.saida, time.time() - wallclock_comeco)
+
+if __name__ == "__main__":
+    main()